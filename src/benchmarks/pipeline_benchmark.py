@@ -0,0 +1,261 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import jsonlines
+
+from data_processing.validate_examples import validate_example
+from json_fixer.convert_to_conversation import convert_to_conversation
+from utils.clean_message import clean_message
+from utils.json_pretty import prettify_json
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+scales = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+payloads = ["small", "large"]
+stages = ["dataset_load", "prettify_json", "clean_message", "convert_to_conversation", "validate_examples", "tokenize"]
+# tokenize needs transformers and has no recorded baseline yet, so it only runs when asked for
+# with --stages. Add it here once its baselines are in baseline.json.
+default_stages = [stage for stage in stages if stage != "tokenize"]
+# Gated metrics. stage_rss_mb is how far the stage pushed the process's peak RSS past what
+# it was after setup, and alloc_peak_mb the tracemalloc peak of the stage alone, so memory
+# taken by loading the dataset doesn't hide a regression inside the stage.
+metrics = ["wall_s", "cpu_s", "stage_rss_mb", "alloc_peak_mb"]
+
+default_threshold = 0.2
+# Differences below these are treated as noise regardless of the relative threshold.
+absolute_noise_floor = {"wall_s": 0.05, "cpu_s": 0.05, "stage_rss_mb": 16.0, "alloc_peak_mb": 4.0}
+
+words = (
+  "okay so here is the plan we do it tomorrow at nine and then we ship it "
+  "the speaker paused for a moment before continuing with the next topic "
+  "it's fine they said, we’ll revisit the numbers after lunch"
+).split()
+
+
+def make_sentence(rng: random.Random, num_words: int) -> str:
+  return " ".join(rng.choice(words) for _ in range(num_words)).capitalize() + "."
+
+
+def make_small_payload(rng: random.Random) -> dict:
+  payload = {}
+  for i in range(rng.randint(1, 5)):
+    kind = rng.randint(0, 3)
+    if kind == 0:
+      payload[f"field_{i}"] = make_sentence(rng, rng.randint(5, 30))
+    elif kind == 1:
+      payload[f"count_{i}"] = rng.randint(0, 10_000)
+    elif kind == 2:
+      payload[f"flags_{i}"] = [rng.choice(["fast", "secure", "beta"]) for _ in range(rng.randint(1, 4))]
+    else:
+      payload[f"meta_{i}"] = {"ok": rng.random() < 0.5, "owner": rng.choice(["alice", "bob"]), "score": None}
+
+  return payload
+
+
+def make_large_payload(rng: random.Random) -> dict:
+  # Transcription-like, about 130-200 lines when pretty-printed, like the generator's large payloads.
+  chapters = []
+  for c in range(rng.randint(4, 6)):
+    segments = [
+      {"speaker": rng.choice(["alice", "bob", "charlie"]), "start": s * 7, "text": make_sentence(rng, rng.randint(8, 40))}
+      for s in range(rng.randint(5, 7))
+    ]
+    chapters.append({"number": c + 1, "title": make_sentence(rng, 3), "segments": segments})
+
+  return {"title": make_sentence(rng, 4), "duration": rng.randint(600, 7200), "chapters": chapters}
+
+
+def make_example(rng: random.Random, payload: str) -> dict:
+  fixed = make_small_payload(rng) if payload == "small" else make_large_payload(rng)
+  fixed_json = json.dumps(fixed, indent=2, ensure_ascii=False)
+  # A trailing comma is the cheapest realistic way to make the input invalid.
+  compact = json.dumps(fixed, ensure_ascii=False)
+
+  return {
+    "invalid_json": compact[:-1] + ",}",
+    "fixed_json": fixed_json,
+    "fixed_reason": "Removed a trailing comma and pretty-printed the corrected JSON."
+  }
+
+
+def write_dataset(path: str, num_examples: int, payload: str, seed: int):
+  rng = random.Random(seed)
+  with jsonlines.open(path, "w") as j:
+    for _ in range(num_examples):
+      j.write(make_example(rng, payload))
+
+
+def run_stage(stage: str, dataset_path: str, tokenizer_id: str, trace_allocations: bool = False) -> dict:
+  """
+  Runs in a fresh process so peak RSS belongs to this stage alone. With `trace_allocations`
+  only the tracemalloc peak is meaningful, tracing slows everything else down.
+  """
+  if stage != "dataset_load":
+    with jsonlines.open(dataset_path) as j:
+      data = list(j)
+
+  if stage == "clean_message":
+    inputs = [f"<think>\n</think>\n```json\n{example['fixed_json']}\n```" for example in data]
+  elif stage == "tokenize":
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_id)
+    inputs = [convert_to_conversation(example)["conversations"] for example in data]
+
+  rss_before_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  if trace_allocations:
+    tracemalloc.start()
+  wall_start = time.perf_counter()
+  cpu_start = time.process_time()
+
+  if stage == "dataset_load":
+    with jsonlines.open(dataset_path) as j:
+      data = list(j)
+  elif stage == "prettify_json":
+    for example in data:
+      prettify_json(example["fixed_json"])
+  elif stage == "clean_message":
+    for message in inputs:
+      clean_message(message)
+  elif stage == "convert_to_conversation":
+    for example in data:
+      convert_to_conversation(example)
+  elif stage == "validate_examples":
+    for example in data:
+      validate_example(example)
+  elif stage == "tokenize":
+    # Same path as formatting_prompts_func in train.py, followed by tokenization.
+    texts = [tokenizer.apply_chat_template(c, tokenize=False, add_generation_prompt=False) for c in inputs]
+    tokenizer(texts, add_special_tokens=False)
+
+  wall_s = time.perf_counter() - wall_start
+  cpu_s = time.process_time() - cpu_start
+  peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  alloc_peak_mb = None
+  if trace_allocations:
+    alloc_peak_mb = tracemalloc.get_traced_memory()[1] / 1024.0**2
+    tracemalloc.stop()
+
+  return {
+    "wall_s": wall_s,
+    "cpu_s": cpu_s,
+    "stage_rss_mb": peak_rss_mb - rss_before_mb,
+    "alloc_peak_mb": alloc_peak_mb,
+    "peak_rss_mb": peak_rss_mb,
+    "rss_before_mb": rss_before_mb
+  }
+
+
+def measure(stage: str, dataset_path: str, tokenizer_id: str, repeat: int) -> dict:
+  # spawn rather than fork, otherwise the child's peak RSS includes the parent's.
+  context = multiprocessing.get_context("spawn")
+  runs = []
+  for _ in range(repeat):
+    with context.Pool(1) as pool:
+      runs.append(pool.apply(run_stage, (stage, dataset_path, tokenizer_id)))
+
+  # A separate run for the allocation peak, so tracing overhead stays out of the timings.
+  with context.Pool(1) as pool:
+    traced = pool.apply(run_stage, (stage, dataset_path, tokenizer_id, True))
+
+  # Best of N is the least noisy estimate of what the code itself costs.
+  result = {metric: min(run[metric] for run in runs) for metric in ["wall_s", "cpu_s", "stage_rss_mb", "peak_rss_mb", "rss_before_mb"]}
+  result["alloc_peak_mb"] = traced["alloc_peak_mb"]
+
+  return result
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+  regressions = []
+  for key, result in results.items():
+    if key not in baseline:
+      continue
+
+    for metric in metrics:
+      current = result[metric]
+      previous = baseline[key].get(metric)
+      if previous is None:
+        regressions.append(f"{key} {metric}: no baseline value, re-record it with --update-baseline")
+        continue
+      if current > previous * (1.0 + threshold) and current - previous > absolute_noise_floor[metric]:
+        regressions.append(f"{key} {metric}: {previous:.3f} -> {current:.3f} (+{(current / previous - 1.0):.1%})")
+
+  return regressions
+
+
+if __name__ == "__main__":
+  from json_fixer.training_config import model_id
+
+  parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic datasets and compare against a stored baseline.")
+  parser.add_argument("--scales", nargs="+", choices=list(scales), default=["1k", "100k"])
+  parser.add_argument("--payloads", nargs="+", choices=payloads, default=payloads)
+  parser.add_argument("--stages", nargs="+", choices=stages, default=default_stages)
+  parser.add_argument("--tokenizer", default=model_id)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--threshold", type=float, default=None, help=f"Allowed relative slowdown. Defaults to the baseline's, or {default_threshold}.")
+  parser.add_argument("--baseline", default=baseline_path)
+  parser.add_argument("--update-baseline", action="store_true", help="Merge these results into the baseline instead of comparing.")
+  parser.add_argument("--allow-missing-baseline", action="store_true", help="Don't fail on stages that have no baseline yet.")
+  parser.add_argument("--output", default=None, help="Also write the results to this JSON file.")
+  parser.add_argument("--seed", type=int, default=42)
+  args = parser.parse_args()
+
+  results = {}
+  with tempfile.TemporaryDirectory() as tmp:
+    for scale in args.scales:
+      for payload in args.payloads:
+        dataset_path = os.path.join(tmp, f"{scale}-{payload}.jsonl")
+        print(f"Generating {scales[scale]} {payload} examples...")
+        write_dataset(dataset_path, scales[scale], payload, args.seed)
+
+        for stage in args.stages:
+          key = f"{scale}-{payload}/{stage}"
+          results[key] = measure(stage, dataset_path, args.tokenizer, args.repeat)
+          r = results[key]
+          print(
+            f"{key:<45} wall {r['wall_s']:>8.3f}s  cpu {r['cpu_s']:>8.3f}s  "
+            f"stage rss {r['stage_rss_mb']:>8.1f} MB  alloc peak {r['alloc_peak_mb']:>8.1f} MB"
+          )
+
+        os.remove(dataset_path)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(results, f, indent=2)
+
+  baseline = {"threshold": default_threshold, "results": {}}
+  if os.path.exists(args.baseline):
+    with open(args.baseline, "r") as f:
+      baseline = json.load(f)
+
+  if args.update_baseline:
+    baseline["results"].update(results)
+    with open(args.baseline, "w") as f:
+      json.dump(baseline, f, indent=2)
+    print(f"Updated baseline {args.baseline}")
+  else:
+    threshold = args.threshold if args.threshold is not None else baseline["threshold"]
+    regressions = compare(results, baseline["results"], threshold)
+
+    # A stage without a baseline is never checked, so it fails unless explicitly allowed.
+    missing = [key for key in results if key not in baseline["results"]]
+    if missing:
+      print(f"No baseline for: {', '.join(missing)}")
+      if not args.allow_missing_baseline:
+        print("Record them with --update-baseline, or pass --allow-missing-baseline.")
+        raise SystemExit(1)
+
+    if regressions:
+      print(f"Regressions beyond {threshold:.0%}:")
+      for regression in regressions:
+        print(f"  {regression}")
+      raise SystemExit(1)
+
+    print(f"No regressions beyond {threshold:.0%}.")
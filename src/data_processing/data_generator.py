@@ -3,11 +3,31 @@ import json
 import jsonlines
 from concurrent.futures import Future, ThreadPoolExecutor
 
-from utils.json_validate import validate_json_string
-from utils.json_pretty import prettify_json
+from data_processing.validate_examples import validate_example
 from utils.strip_think_tags import strip_think_tags
 
-def get_prompt() -> str:
+def get_focus_prompt(focus: dict) -> str:
+  """
+  Extra instructions steering a run towards the categories the model fails on most.
+  `focus` maps error types to how many of the N=5 items should contain them, and may have a
+  "large" entry overriding how many items are large payloads.
+  """
+  lines = [
+    "",
+    "Focus requirements for this run (IMPORTANT, these take precedence over the mix requirements above):"
+  ]
+  for error_type, count in focus.items():
+    if error_type == "large":
+      lines.append(f"- EXACTLY {count} of the 5 items must be large payloads.")
+    elif count > 0:
+      lines.append(f"- At least {count} of the 5 items must contain the \"{error_type}\" error type.")
+
+  lines.append("")
+  lines.append("Return ONLY the JSON array of objects.")
+
+  return "\n".join(lines) + "\n"
+
+def get_prompt(focus: dict | None = None) -> str:
   prompt = r"""You are a data generator. Produce N examples of “invalid JSON” paired with the corrected “valid JSON”.
 
 Output format (STRICT):
@@ -264,6 +284,9 @@ Now generate N=5.
 Return ONLY the JSON array of objects.
 """
 
+  if focus:
+    prompt += get_focus_prompt(focus)
+
   return prompt
 
 def create_client():
@@ -272,11 +295,11 @@ def create_client():
     api_key="none"
   )
 
-def generate(client: openai.Client, attempt=0):
+def generate(client: openai.Client, attempt=0, focus: dict | None = None):
   if attempt == 3:
     return []
 
-  user_prompt = get_prompt()
+  user_prompt = get_prompt(focus)
   messages = [{"role": "user", "content": user_prompt}]
   model = "gpt-oss-20b"
 
@@ -307,13 +330,10 @@ def generate(client: openai.Client, attempt=0):
     print(len(generated_json))
 
     for g in generated_json:
-      # Check fixed_json, not fixed_reason (which is just text)
-      try:
-        if not validate_json_string(prettify_json(g["fixed_json"])):
-          print("Error: Invalid json in fixed_json!")
-          continue
-      except Exception as e:
-        print(f"Validation error: {e}")
+      # Structural checks parse each field once (see validate_examples.py).
+      rejections = validate_example(g) if isinstance(g, dict) else ["malformed_record"]
+      if rejections:
+        print(f"Error: rejected generated example: {', '.join(rejections)}")
         continue
 
       results.append(
@@ -326,7 +346,7 @@ def generate(client: openai.Client, attempt=0):
 
     return results
   except:
-    return generate(client, attempt + 1)
+    return generate(client, attempt + 1, focus)
 
 
 
@@ -2,6 +2,8 @@ import openai
 import os
 import json
 import jsonlines
+from collections import Counter
+from data_processing.validate_examples import validate_example
 from utils.clean_message import clean_message
 
 base_dataset_directory = "/home/rngo/code/intel-gpu-fine-tune/dataset"
@@ -140,6 +142,20 @@ if __name__ == "__main__":
   dataset = unique_dataset
   print(f"Dataset examples after deduplication: {len(dataset)}")
 
+  # Cheap structural checks first, so the LLM judge only sees plausible examples.
+  rejection_counts = Counter()
+  structurally_valid = []
+  for example in dataset:
+    rejections = validate_example(example)
+    rejection_counts.update(rejections)
+    if not rejections:
+      structurally_valid.append(example)
+
+  dataset = structurally_valid
+  print(f"Dataset examples after structural validation: {len(dataset)}")
+  for rule, count in rejection_counts.most_common():
+    print(f"  {rule}: {count}")
+
   client = create_client()
 
   filtered = []
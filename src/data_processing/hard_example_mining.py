@@ -0,0 +1,353 @@
+import argparse
+import json
+import random
+
+import jsonlines
+
+from utils.example_tags import error_type_names, get_payload_size
+from utils.json_pretty import prettify_json
+from utils.json_tokens import escape_pattern, scan_tokens
+from utils.json_validate import loads_strict
+
+# Laplace smoothing so categories with few (or no) recorded outcomes still get some budget.
+smoothing = 1.0
+examples_per_llm_run = 5
+
+fixed_reasons = {
+  "newline": "Escaped literal newlines inside a string value using \\n and pretty-printed the corrected JSON.",
+  "quotes": "Escaped inner double quotes inside a string value with \\\" and pretty-printed the corrected JSON.",
+  "backslash": "Doubled unescaped backslashes inside a string value and pretty-printed the corrected JSON.",
+  "unquoted_key": "Quoted a previously unquoted object key and pretty-printed the corrected JSON.",
+  "unquoted_value": "Added quotes around a bareword string value and pretty-printed the corrected JSON.",
+  "comma": "Removed an extra comma and pretty-printed the corrected JSON.",
+  "extra_brace": "Removed an extra closing brace/bracket and pretty-printed the corrected JSON.",
+  "comment": "Removed JSON comments and pretty-printed the corrected JSON.",
+  "nonfinite_number": "Converted non-finite numbers (NaN/Infinity) into strings and pretty-printed the corrected JSON."
+}
+
+
+def load_outcomes(paths: list[str], model: str | None = None, source: str | None = None) -> list[dict]:
+  """
+  Read outcome logs, optionally keeping only one model and one source. Rescoring the same
+  model on the same inputs logs them again, so only the latest outcome per (source, model,
+  input) is kept.
+  """
+  latest = {}
+  for path in paths:
+    with jsonlines.open(path) as j:
+      for outcome in j:
+        if model is not None and outcome["model"] != model:
+          continue
+        if source is not None and outcome["source"] != source:
+          continue
+        latest[(outcome["source"], outcome["model"], outcome["invalid_json"])] = outcome
+
+  return list(latest.values())
+
+
+def aggregate_failure_rates(outcomes: list[dict]) -> dict:
+  """
+  Failure counts and rates per source, error type and payload size. Sources are kept apart
+  because "passed" means an exact match for test outcomes but only valid JSON for production
+  traffic, which has no ground truth.
+  """
+  by_source = {}
+
+  def add(source: str, group: str, name: str, passed: bool):
+    categories = by_source.setdefault(source, {"error_type": {}, "payload_size": {}})
+    stats = categories[group].setdefault(name, {"total": 0, "failed": 0})
+    stats["total"] += 1
+    stats["failed"] += 0 if passed else 1
+
+  for outcome in outcomes:
+    for error_type in outcome["error_types"]:
+      add(outcome["source"], "error_type", error_type, outcome["passed"])
+    add(outcome["source"], "payload_size", outcome["payload_size"], outcome["passed"])
+
+  for categories in by_source.values():
+    for group in categories.values():
+      for stats in group.values():
+        stats["failure_rate"] = (stats["failed"] + smoothing) / (stats["total"] + 2 * smoothing)
+
+  return by_source
+
+
+def allocate_budget(failure_rates: dict, budget: int) -> dict:
+  """
+  Split `budget` new examples across error types in proportion to their smoothed failure
+  rate. Error types that never showed up in the outcomes get the prior rate of 0.5.
+  """
+  rates = {
+    error_type: failure_rates["error_type"].get(error_type, {"failure_rate": 0.5})["failure_rate"]
+    for error_type in error_type_names
+  }
+  total_rate = sum(rates.values())
+
+  # Largest-remainder rounding so the allocation sums to exactly `budget`.
+  exact = {k: budget * v / total_rate for k, v in rates.items()}
+  allocation = {k: int(v) for k, v in exact.items()}
+  remainder = budget - sum(allocation.values())
+  for k in sorted(exact, key=lambda k: exact[k] - allocation[k], reverse=True)[:remainder]:
+    allocation[k] += 1
+
+  return allocation
+
+
+def get_large_payload_share(failure_rates: dict) -> float:
+  sizes = failure_rates["payload_size"]
+  large_rate = sizes.get("large", {"failure_rate": 0.5})["failure_rate"]
+  other_rates = [v["failure_rate"] for k, v in sizes.items() if k != "large"] or [0.5]
+
+  return large_rate / (large_rate + sum(other_rates) / len(other_rates))
+
+
+def scan_json_text(text: str) -> tuple[list[int], list[tuple[int, str]], list[tuple[int, int]]]:
+  """
+  Walk valid JSON text and return the indices of characters outside strings, the position
+  and character of every escape sequence inside strings, and the (start, end) span of every
+  string token including its quotes.
+  """
+  structural = []
+  escapes = []
+  strings = []
+  for kind, token, start, _, _ in scan_tokens(text):
+    if kind == "string":
+      strings.append((start, start + len(token)))
+      escapes.extend((start + match.start(), match.group(0)[1:2]) for match in escape_pattern.finditer(token))
+    else:
+      structural.extend(range(start, start + len(token)))
+
+  return structural, escapes, strings
+
+
+def inject_newline(text: str, rng: random.Random) -> str | None:
+  _, escapes, _ = scan_json_text(text)
+  candidates = [i for i, c in escapes if c == "n"]
+  if not candidates:
+    return None
+
+  i = rng.choice(candidates)
+  return text[:i] + "\n" + text[i + 2:]
+
+
+def inject_quotes(text: str, rng: random.Random) -> str | None:
+  _, escapes, _ = scan_json_text(text)
+  candidates = [i for i, c in escapes if c == "\""]
+  if not candidates:
+    return None
+
+  i = rng.choice(candidates)
+  return text[:i] + text[i + 1:]
+
+
+def inject_backslash(text: str, rng: random.Random) -> str | None:
+  _, escapes, _ = scan_json_text(text)
+  # Only un-double backslashes where the result is an invalid escape rather than a different valid one.
+  candidates = [i for i, c in escapes if c == "\\" and i + 2 < len(text) and text[i + 2] not in "\"\\/bfnrtu"]
+  if not candidates:
+    return None
+
+  i = rng.choice(candidates)
+  return text[:i] + text[i + 1:]
+
+
+def is_bareword(value: str) -> bool:
+  return value.isidentifier() and value not in ("true", "false", "null", "NaN", "Infinity")
+
+
+def inject_unquoted_token(text: str, rng: random.Random, keys: bool) -> str | None:
+  candidates = []
+  for start, end in scan_json_text(text)[2]:
+    rest = text[end:].lstrip()
+    is_key = rest.startswith(":")
+    if is_key == keys and is_bareword(text[start + 1:end - 1]):
+      candidates.append((start, end))
+
+  if not candidates:
+    return None
+
+  start, end = rng.choice(candidates)
+  return text[:start] + text[start + 1:end - 1] + text[end:]
+
+
+def inject_nonfinite_number(text: str, rng: random.Random) -> str | None:
+  candidates = []
+  for start, end in scan_json_text(text)[2]:
+    if text[start + 1:end - 1] in ("NaN", "Infinity", "-Infinity") and not text[end:].lstrip().startswith(":"):
+      candidates.append((start, end))
+
+  if not candidates:
+    return None
+
+  start, end = rng.choice(candidates)
+  return text[:start] + text[start + 1:end - 1] + text[end:]
+
+
+def inject_comma(text: str, rng: random.Random) -> str | None:
+  structural, _, _ = scan_json_text(text)
+  commas = [i for i in structural if text[i] == ","]
+  closers = [i for i in structural if text[i] in "]}" and text[:i].rstrip()[-1:] not in "[{"]
+  options = [("double", i) for i in commas] + [("trailing", i) for i in closers]
+  if not options:
+    return None
+
+  kind, i = rng.choice(options)
+  if kind == "double":
+    return text[:i] + ",," + text[i + 1:]
+
+  # Put the trailing comma right after the last value, before any whitespace.
+  j = len(text[:i].rstrip())
+  return text[:j] + "," + text[j:]
+
+
+def inject_comment(text: str, rng: random.Random) -> str | None:
+  structural, _, _ = scan_json_text(text)
+  commas = [i for i in structural if text[i] == ","]
+  if not commas:
+    return None
+
+  i = rng.choice(commas)
+  if text[i + 1:i + 2] == "\n":
+    return text[:i + 1] + " // " + rng.choice(["TODO: double check this", "added by hand", "see ticket"]) + text[i + 1:]
+
+  return text[:i + 1] + " /* " + rng.choice(["legacy", "temporary", "do not remove"]) + " */" + text[i + 1:]
+
+
+def inject_extra_brace(text: str, rng: random.Random) -> str | None:
+  stripped = text.rstrip()
+  closer = "}" if stripped.endswith("}") else "]"
+
+  return stripped + closer
+
+
+injectors = {
+  "newline": inject_newline,
+  "quotes": inject_quotes,
+  "backslash": inject_backslash,
+  "unquoted_key": lambda text, rng: inject_unquoted_token(text, rng, keys=True),
+  "unquoted_value": lambda text, rng: inject_unquoted_token(text, rng, keys=False),
+  "comma": inject_comma,
+  "extra_brace": inject_extra_brace,
+  "comment": inject_comment,
+  "nonfinite_number": inject_nonfinite_number
+}
+
+
+def generate_programmatic(base_examples: list[dict], allocation: dict, large_payload_share: float, rng: random.Random, attempts: int = 50) -> list[dict]:
+  """
+  Create new examples by breaking the valid fixed_json of existing examples with exactly the
+  error types in `allocation`. The fixed_json is kept as-is, so every example is correct by
+  construction. Large payloads are picked with probability `large_payload_share`.
+  """
+  by_size = {}
+  for example in base_examples:
+    by_size.setdefault(get_payload_size(example["fixed_json"]) == "large", []).append(example)
+
+  results = []
+  for error_type, count in allocation.items():
+    for _ in range(count):
+      for _ in range(attempts):
+        want_large = rng.random() < large_payload_share and True in by_size
+        example = rng.choice(by_size.get(want_large) or base_examples)
+        fixed_json = prettify_json(example["fixed_json"])
+        # Vary formatting like the LLM-generated data does: pretty-printed or one long line.
+        source = fixed_json if rng.random() < 0.5 else json.dumps(json.loads(fixed_json), ensure_ascii=False)
+
+        invalid_json = injectors[error_type](source, rng)
+        if invalid_json is None:
+          continue
+
+        try:
+          loads_strict(invalid_json)
+          continue
+        except json.JSONDecodeError:
+          pass
+
+        results.append({
+          "invalid_json": invalid_json,
+          "fixed_json": fixed_json,
+          "fixed_reason": fixed_reasons[error_type]
+        })
+        break
+
+  return results
+
+
+def get_llm_focus(allocation: dict, large_payload_share: float) -> dict:
+  """Scale an allocation down to the N=5 items of a single data_generator run."""
+  total = sum(allocation.values()) or 1
+  focus = {k: round(examples_per_llm_run * v / total) for k, v in allocation.items()}
+  focus["large"] = round(examples_per_llm_run * large_payload_share)
+
+  return focus
+
+
+def generate_llm(allocation: dict, large_payload_share: float) -> list[dict]:
+  from data_processing.data_generator import create_client, generate
+
+  client = create_client()
+  focus = get_llm_focus(allocation, large_payload_share)
+  budget = sum(allocation.values())
+
+  results = []
+  consecutive_failures = 0
+  while len(results) < budget and consecutive_failures < 5:
+    batch = generate(client, 0, focus)
+    consecutive_failures = 0 if batch else consecutive_failures + 1
+    results.extend(batch)
+    print(f"Generated {len(results)}/{budget} examples.")
+
+  return results[:budget]
+
+
+def print_failure_rates(failure_rates: dict):
+  for source, groups in failure_rates.items():
+    for group, categories in groups.items():
+      print(f"{source} / {group}:")
+      for name, stats in sorted(categories.items(), key=lambda item: item[1]["failure_rate"], reverse=True):
+        print(f"  {name:<20} failed {stats['failed']:>5}/{stats['total']:<5} rate {stats['failure_rate']:.2%}")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Steer data generation towards the categories the model fails on most.")
+  parser.add_argument("outcomes", nargs="+", help="Outcome JSONL files written by model_eval.py or serve.py.")
+  parser.add_argument("--model", default=None, help="Only use outcomes of this model key. Required when the logs cover more than one model.")
+  parser.add_argument("--source", choices=["test", "production"], default="test", help="Outcomes to report on and steer generation with. Test outcomes are exact-match scored, production ones only check for valid JSON.")
+  parser.add_argument("--budget", type=int, default=0, help="Number of new examples to generate. 0 only prints the report.")
+  parser.add_argument("--mode", choices=["programmatic", "llm"], default="programmatic")
+  parser.add_argument("--base-dataset", default="dataset/train_data.jsonl", help="Valid examples to corrupt in programmatic mode.")
+  parser.add_argument("--output", default="mined_data.jsonl")
+  parser.add_argument("--seed", type=int, default=42)
+  args = parser.parse_args()
+
+  outcomes = load_outcomes(args.outcomes, model=args.model, source=args.source)
+  if not outcomes:
+    print(f"No {args.source} outcomes{f' for {args.model}' if args.model else ''}.")
+    raise SystemExit(1)
+
+  models = {outcome["model"] for outcome in outcomes}
+  if len(models) > 1:
+    print(f"The {args.source} outcomes cover {len(models)} models, pick one with --model:")
+    for model in sorted(models, key=str):
+      print(f"  {model}")
+    raise SystemExit(1)
+
+  failure_rates = aggregate_failure_rates(outcomes)
+  print_failure_rates(failure_rates)
+
+  if args.budget > 0:
+    allocation = allocate_budget(failure_rates[args.source], args.budget)
+    large_payload_share = get_large_payload_share(failure_rates[args.source])
+    print(f"Allocation from {args.source} outcomes: {allocation}, large payload share {large_payload_share:.2f}")
+
+    if args.mode == "programmatic":
+      with jsonlines.open(args.base_dataset) as j:
+        base_examples = list(j)
+      results = generate_programmatic(base_examples, allocation, large_payload_share, random.Random(args.seed))
+    else:
+      results = generate_llm(allocation, large_payload_share)
+
+    with jsonlines.open(args.output, "w") as j:
+      j.write_all(results)
+
+    print(f"Wrote {len(results)} examples to {args.output}")
@@ -0,0 +1,284 @@
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter
+from multiprocessing import Pool
+
+import jsonlines
+
+from utils.json_tokens import scan_tokens
+from utils.json_validate import loads_strict
+
+rules = [
+  "malformed_record",
+  "fixed_not_json",
+  "invalid_parses",
+  "root_type_changed",
+  "keys_changed",
+  "key_order_changed",
+  "comment_kept",
+  "nonfinite_not_quoted"
+]
+
+nonfinite_tokens = ("NaN", "Infinity", "-Infinity")
+# Modules whose code decides the outcome of a validation. Cached results are only reused
+# while all of them are unchanged.
+rule_modules = ["data_processing/validate_examples.py", "utils/json_tokens.py", "utils/json_validate.py"]
+
+
+def parse_string_token(token: str) -> str:
+  body = token[1:-1] if len(token) > 1 and token[-1] == token[0] else token[1:]
+  try:
+    return json.loads(f"\"{body}\"")
+  except json.JSONDecodeError:
+    return body
+
+
+def scan_lenient(text: str, implicit_root: str | None = None) -> dict:
+  """
+  Single pass over possibly-invalid JSON text that collects the root container type, the
+  top-level object keys in order, comments and bare NaN/Infinity tokens, all outside of strings.
+
+  Text that doesn't start with an opener but ends with a closer has lost its opening brace,
+  one of the generator's error types. It is scanned again with the root implied by the closer.
+  """
+  root = implicit_root
+  keys = []
+  comments = []
+  nonfinite = Counter()
+
+  first = None
+  last = None
+  pending_key = None
+  for kind, token, _, depth, key_position in scan_tokens(text, implicit_root):
+    if kind == "space":
+      continue
+
+    if kind == "line_comment":
+      comments.append(token[2:].strip())
+      continue
+
+    if kind == "block_comment":
+      comments.append(token[2:-2 if token.endswith("*/") else None].strip())
+      continue
+
+    first = token if first is None else first
+    last = token
+
+    if token == ":":
+      if pending_key is not None:
+        keys.append(pending_key)
+      pending_key = None
+      continue
+
+    pending_key = None
+
+    if kind in ("string", "quoted_key", "bareword") and depth == 1 and key_position:
+      pending_key = parse_string_token(token) if kind != "bareword" else token
+    elif token in ("{", "[") and root is None:
+      root = token
+    elif kind == "bareword" and token in nonfinite_tokens:
+      nonfinite[token] += 1
+
+  if implicit_root is None and first not in ("{", "[") and last in ("}", "]"):
+    return scan_lenient(text, "{" if last == "}" else "[")
+
+  return {"root": root, "keys": keys, "comments": comments, "nonfinite": nonfinite}
+
+
+def find_key(text: str, key: str, start: int) -> int:
+  positions = [text.find(f"{q}{key}{q}", start) for q in ("\"", "'", "")]
+  positions = [p for p in positions if p != -1]
+
+  return min(positions) if positions else -1
+
+
+def check_keys(invalid_json: str, fixed_keys: list[str], scanned_keys: list[str]) -> str | None:
+  """
+  Top-level keys of the fix must all appear in the input, in the same order, and the input
+  must not have top-level keys the fix dropped. Presence and order are checked by searching
+  the raw text, which is more forgiving of broken strings than the lenient scan.
+  """
+  if set(scanned_keys) - set(fixed_keys):
+    return "keys_changed"
+
+  position = 0
+  for key in fixed_keys:
+    found = find_key(invalid_json, key, position)
+    if found == -1:
+      return "keys_changed" if find_key(invalid_json, key, 0) == -1 else "key_order_changed"
+    position = found + len(key)
+
+  return None
+
+
+def collect_string_values(value, values: Counter):
+  if isinstance(value, dict):
+    for v in value.values():
+      collect_string_values(v, values)
+  elif isinstance(value, list):
+    for v in value:
+      collect_string_values(v, values)
+  elif isinstance(value, str):
+    values[value] += 1
+
+
+def validate_example(example: dict) -> list[str]:
+  """
+  Check the structural invariants the generator prompt asks for, parsing each field once.
+  Returns the names of the rules the example breaks.
+  """
+  invalid_json = example.get("invalid_json")
+  fixed_json = example.get("fixed_json")
+  if not isinstance(invalid_json, str) or not isinstance(fixed_json, str):
+    return ["malformed_record"]
+
+  rejections = []
+
+  try:
+    fixed = loads_strict(fixed_json)
+  except json.JSONDecodeError:
+    fixed = None
+    rejections.append("fixed_not_json")
+
+  try:
+    loads_strict(invalid_json)
+    rejections.append("invalid_parses")
+  except json.JSONDecodeError:
+    pass
+
+  if fixed is None:
+    return rejections
+
+  scanned = scan_lenient(invalid_json)
+
+  fixed_root = "{" if isinstance(fixed, dict) else "[" if isinstance(fixed, list) else None
+  if scanned["root"] != fixed_root:
+    rejections.append("root_type_changed")
+  elif fixed_root == "{":
+    key_check = check_keys(invalid_json, list(fixed.keys()), scanned["keys"])
+    if key_check:
+      rejections.append(key_check)
+
+  string_values = Counter()
+  collect_string_values(fixed, string_values)
+
+  # Comments must be removed, not turned into keys or values. Text that also shows up outside
+  # of comments in the input was there to begin with.
+  comments = [comment for comment in scanned["comments"] if comment]
+  fixed_keys = set(fixed.keys()) if isinstance(fixed, dict) else set()
+  if any(
+    (comment in string_values or comment in fixed_keys) and invalid_json.count(comment) <= comments.count(comment)
+    for comment in comments
+  ):
+    rejections.append("comment_kept")
+
+  # Bare NaN/Infinity must survive as the equivalent strings, not be dropped or nulled.
+  if any(string_values[token] < count for token, count in scanned["nonfinite"].items()):
+    rejections.append("nonfinite_not_quoted")
+
+  return rejections
+
+
+def validate_line(line: str) -> tuple[str, list[str]]:
+  digest = hashlib.sha256(line.encode("utf-8")).hexdigest()
+  try:
+    example = json.loads(line)
+  except json.JSONDecodeError:
+    return digest, ["malformed_record"]
+
+  if not isinstance(example, dict):
+    return digest, ["malformed_record"]
+
+  return digest, validate_example(example)
+
+
+def get_rules_version() -> str:
+  src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  digest = hashlib.sha256()
+  for module in rule_modules:
+    with open(os.path.join(src_dir, module), "rb") as f:
+      digest.update(f.read())
+
+  return digest.hexdigest()[:16]
+
+
+def load_validation_cache(path: str) -> dict:
+  if not os.path.exists(path):
+    return {}
+
+  with jsonlines.open(path) as j:
+    return {entry["sha256"]: entry["rejections"] for entry in j}
+
+
+def stream_lines(path: str):
+  with open(path, "r", encoding="utf-8") as f:
+    for line in f:
+      line = line.strip()
+      if line:
+        yield line
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Cheap structural validation of generated examples, meant to run before the LLM judge in dataset_eval.py.")
+  parser.add_argument("dataset", help="JSONL file with invalid_json/fixed_json records.")
+  parser.add_argument("--output", default=None, help="Accepted examples. Defaults to <dataset>.valid.jsonl.")
+  parser.add_argument("--rejected", default=None, help="Rejected examples with their rules. Defaults to <dataset>.rejected.jsonl.")
+  parser.add_argument("--report", default=None, help="Per-rule rejection counts. Defaults to <dataset>.validation_report.json.")
+  parser.add_argument("--num-proc", type=int, default=os.cpu_count() or 1)
+  parser.add_argument("--chunksize", type=int, default=64)
+  args = parser.parse_args()
+
+  base = os.path.splitext(args.dataset)[0]
+  output_path = args.output or f"{base}.valid.jsonl"
+  rejected_path = args.rejected or f"{base}.rejected.jsonl"
+  report_path = args.report or f"{base}.validation_report.json"
+  # Results are cached by record hash, so re-running after appending new examples only
+  # validates the new ones. Changing the rules starts a new cache.
+  cache_path = f"{base}.validation_cache.{get_rules_version()}.jsonl"
+
+  cache = load_validation_cache(cache_path)
+  counts = Counter()
+  total = 0
+  accepted = 0
+  validated = 0
+
+  def uncached_lines():
+    for line in stream_lines(args.dataset):
+      if hashlib.sha256(line.encode("utf-8")).hexdigest() not in cache:
+        yield line
+
+  with Pool(args.num_proc) as pool, jsonlines.open(cache_path, "a") as cache_writer:
+    for digest, rejections in pool.imap(validate_line, uncached_lines(), chunksize=args.chunksize):
+      cache[digest] = rejections
+      cache_writer.write({"sha256": digest, "rejections": rejections})
+      validated += 1
+
+  with jsonlines.open(output_path, "w") as accepted_writer, jsonlines.open(rejected_path, "w") as rejected_writer:
+    for line in stream_lines(args.dataset):
+      rejections = cache[hashlib.sha256(line.encode("utf-8")).hexdigest()]
+      total += 1
+      counts.update(rejections)
+
+      if rejections:
+        rejected_writer.write({"rejections": rejections, "example": json.loads(line) if "malformed_record" not in rejections else line})
+      else:
+        accepted_writer.write(json.loads(line))
+        accepted += 1
+
+  report = {
+    "total": total,
+    "accepted": accepted,
+    "rejected": total - accepted,
+    "validated_this_run": validated,
+    "rejections_per_rule": {rule: counts[rule] for rule in rules}
+  }
+  with open(report_path, "w") as f:
+    json.dump(report, f, indent=2)
+
+  print(f"Validated {validated} new records ({total - validated} cached).")
+  print(f"Accepted {accepted}/{total}.")
+  for rule in rules:
+    print(f"  {rule:<22} {counts[rule]}")
+  print(f"Wrote {output_path}, {rejected_path} and {report_path}")
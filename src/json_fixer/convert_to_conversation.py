@@ -1,6 +1,10 @@
 from utils.json_pretty import prettify_json
 
 
+def build_user_prompt(input_json: str) -> str:
+  return f"Fix this JSON:\n{input_json}"
+
+
 def convert_to_conversation(example):
   input_json = example["invalid_json"]
   fixed_json = example["fixed_json"]
@@ -8,7 +12,7 @@ def convert_to_conversation(example):
   messages = [
     {
       "role": "user",
-      "content": f"Fix this JSON:\n{input_json}"
+      "content": build_user_prompt(input_json)
     },
     {
       "role": "assistant",
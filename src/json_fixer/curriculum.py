@@ -0,0 +1,255 @@
+import json
+import os
+from collections import deque
+
+import torch
+from torch.utils.data import Sampler
+from transformers import TrainerCallback
+from trl import SFTTrainer
+
+from utils.example_tags import detect_error_types, get_payload_size
+
+curriculum_modes = ["uniform", "tags", "loss"]
+payload_size_difficulty = {"small": 0, "medium": 1, "large": 2}
+# Positions per cross-entropy chunk. A full-vocabulary fp32 copy of a whole 2048-token row
+# would be over a gigabyte on top of the logits the model already returned.
+loss_chunk_size = 256
+
+
+def get_difficulty_prior(example: dict) -> float:
+  """Static difficulty from payload size and number of error types; 1.0 is the easiest."""
+  error_types = [e for e in detect_error_types(example["invalid_json"], example["fixed_json"]) if e != "unknown"]
+
+  return 1.0 + max(0, len(error_types) - 1) + payload_size_difficulty[get_payload_size(example["fixed_json"])]
+
+
+@torch.no_grad()
+def get_per_example_loss(logits: torch.Tensor, labels: torch.Tensor, chunk_size: int = loss_chunk_size) -> torch.Tensor:
+  """
+  Mean next-token loss of each row, computed `chunk_size` positions at a time so only one
+  chunk of logits is upcast at once.
+  """
+  batch_size, sequence_length, vocab_size = logits.shape
+  loss_sum = torch.zeros(batch_size, device=logits.device)
+  token_count = torch.zeros(batch_size, device=logits.device)
+
+  for start in range(0, sequence_length - 1, chunk_size):
+    end = min(start + chunk_size, sequence_length - 1)
+    chunk_labels = labels[:, start + 1:end + 1]
+    chunk_loss = torch.nn.functional.cross_entropy(
+      logits[:, start:end].reshape(-1, vocab_size).float(),
+      chunk_labels.reshape(-1),
+      ignore_index=-100,
+      reduction="none"
+    ).view(batch_size, -1)
+    mask = chunk_labels != -100
+    loss_sum += (chunk_loss * mask).sum(dim=1)
+    token_count += mask.sum(dim=1)
+
+  return loss_sum / token_count.clamp(min=1.0)
+
+
+class CurriculumSampler(Sampler):
+  """
+  Draws each epoch's training order with weights that shift compute away from examples the
+  model has already learned.
+
+  - "uniform": a plain shuffle every epoch, the baseline to compare against.
+  - "tags": weights grow from uniform towards the static difficulty prior (size and number
+    of error types) as training progresses.
+  - "loss": after `warmup_epochs` of plain shuffles, weights follow each example's
+    exponential moving average training loss. Examples below `easy_loss_threshold` have
+    their weight multiplied by `easy_weight` (0 drops them entirely).
+
+  In "loss" mode, indices handed out are queued in `pending` so the trainer can attribute
+  per-example losses back to dataset rows in the order batches are consumed.
+  """
+  def __init__(
+    self,
+    examples: list[dict],
+    num_epochs: int,
+    mode: str = "loss",
+    warmup_epochs: int = 1,
+    easy_loss_threshold: float = 0.05,
+    easy_weight: float = 0.1,
+    loss_ema_decay: float = 0.5,
+    seed: int = 42
+  ):
+    if mode not in curriculum_modes:
+      raise ValueError(f"Unknown curriculum mode: {mode}. Expected one of {curriculum_modes}.")
+
+    self.num_examples = len(examples)
+    self.num_epochs = num_epochs
+    self.mode = mode
+    self.warmup_epochs = warmup_epochs
+    self.easy_loss_threshold = easy_loss_threshold
+    self.easy_weight = easy_weight
+    self.loss_ema_decay = loss_ema_decay
+
+    self.priors = torch.tensor([get_difficulty_prior(example) for example in examples], dtype=torch.float)
+    self.loss_ema = torch.full((self.num_examples,), float("nan"))
+    self.epoch = 0
+    self.pending = deque()
+    self.generator = torch.Generator().manual_seed(seed)
+
+  def __len__(self) -> int:
+    return self.num_examples
+
+  def get_weights(self) -> torch.Tensor | None:
+    """Sampling weights for the current epoch, or None for a plain shuffle."""
+    if self.mode == "uniform":
+      return None
+
+    if self.mode == "tags":
+      progress = min(1.0, self.epoch / max(1, self.num_epochs - 1))
+      return self.priors ** progress
+
+    if self.epoch < self.warmup_epochs:
+      return None
+
+    seen = ~torch.isnan(self.loss_ema)
+    mean_loss = self.loss_ema[seen].mean() if seen.any() else torch.tensor(1.0)
+    # Examples we haven't seen a loss for yet are placed by their prior relative to the mean.
+    weights = torch.where(seen, self.loss_ema, mean_loss * self.priors / self.priors.mean())
+    weights = torch.where(seen & (self.loss_ema < self.easy_loss_threshold), weights * self.easy_weight, weights)
+
+    if weights.sum() <= 0:
+      return None
+
+    return weights.clamp(min=0.0)
+
+  def __iter__(self):
+    weights = self.get_weights()
+    if weights is None:
+      order = torch.randperm(self.num_examples, generator=self.generator)
+    else:
+      order = torch.multinomial(weights, self.num_examples, replacement=True, generator=self.generator)
+
+    self.epoch += 1
+    for idx in order.tolist():
+      if self.mode == "loss":
+        self.pending.append(idx)
+      yield idx
+
+  def update_losses(self, indices: list[int], losses: list[float]):
+    for idx, loss in zip(indices, losses):
+      previous = self.loss_ema[idx]
+      if torch.isnan(previous):
+        self.loss_ema[idx] = loss
+      else:
+        self.loss_ema[idx] = self.loss_ema_decay * previous + (1.0 - self.loss_ema_decay) * loss
+
+  def get_summary(self) -> dict:
+    seen = ~torch.isnan(self.loss_ema)
+
+    return {
+      "epoch": self.epoch,
+      "seen_examples": int(seen.sum()),
+      "easy_examples": int((seen & (self.loss_ema < self.easy_loss_threshold)).sum()),
+      "mean_loss_ema": float(self.loss_ema[seen].mean()) if seen.any() else None
+    }
+
+
+class CurriculumSFTTrainer(SFTTrainer):
+  """
+  SFTTrainer that draws batches from a CurriculumSampler and feeds it per-example losses.
+
+  Resuming from a checkpoint is not supported in "loss" mode. The sampler's generator,
+  epoch and loss EMAs aren't checkpointed, and the Trainer skips the already-seen batches by
+  drawing them through the sampler, so every later loss would be credited to the wrong row
+  via `pending`. In the other modes a resumed run only sees a different example order.
+  """
+  def __init__(self, *args, curriculum_sampler: CurriculumSampler, **kwargs):
+    self.curriculum_sampler = curriculum_sampler
+    super().__init__(*args, **kwargs)
+
+  def train(self, resume_from_checkpoint=None, *args, **kwargs):
+    if resume_from_checkpoint and self.curriculum_sampler.mode == "loss":
+      raise ValueError(
+        "Resuming from a checkpoint is not supported with curriculum mode \"loss\". "
+        "Start a fresh run, or use \"uniform\" or \"tags\"."
+      )
+
+    return super().train(resume_from_checkpoint, *args, **kwargs)
+
+  def _get_train_sampler(self, train_dataset=None):
+    return self.curriculum_sampler
+
+  def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+    labels = inputs["labels"]
+    (loss, outputs) = super().compute_loss(model, inputs, return_outputs=True, num_items_in_batch=num_items_in_batch)
+
+    # Only "loss" mode reads the loss EMAs, so the others skip the extra cross-entropy.
+    if self.model.training and self.curriculum_sampler.mode == "loss":
+      batch_size = labels.shape[0]
+      indices = [self.curriculum_sampler.pending.popleft() for _ in range(batch_size)]
+
+      per_example_loss = get_per_example_loss(outputs.logits, labels)
+      self.curriculum_sampler.update_losses(indices, per_example_loss.tolist())
+
+    return (loss, outputs) if return_outputs else loss
+
+
+class TokensToTargetCallback(TrainerCallback):
+  """
+  Records how many training tokens it took for the generative accuracy reported by
+  GenerativeAccuracyCallback to first reach `target_accuracy`, and writes a summary per
+  curriculum mode so runs can be compared against the uniform baseline.
+  """
+  def __init__(self, trainer: CurriculumSFTTrainer, generative_accuracy_callback, target_accuracy: float, output_dir: str):
+    self.trainer = trainer
+    self.generative_accuracy_callback = generative_accuracy_callback
+    self.target_accuracy = target_accuracy
+    self.output_dir = output_dir
+    self.evaluations_seen = 0
+    self.reached = None
+
+  def get_summary_path(self, mode: str) -> str:
+    return os.path.join(self.output_dir, f"tokens_to_target_{mode}.json")
+
+  def on_step_end(self, args, state, control, **kwargs):
+    history = self.generative_accuracy_callback.history
+    if len(history) == self.evaluations_seen:
+      return control
+
+    self.evaluations_seen = len(history)
+    latest = history[-1]
+    if self.reached is None and latest["accuracy"] >= self.target_accuracy:
+      self.reached = {
+        "step": latest["step"],
+        "tokens": self.trainer._total_train_tokens,
+        "accuracy": latest["accuracy"]
+      }
+      state.log_history.append({"step": state.global_step, "tokens_to_target_accuracy": self.reached["tokens"]})
+      print(f"Reached {self.target_accuracy:.2%} generative accuracy after {self.reached['tokens']} tokens.")
+
+    return control
+
+  def on_train_end(self, args, state, control, **kwargs):
+    mode = self.trainer.curriculum_sampler.mode
+    summary = {
+      "mode": mode,
+      "target_accuracy": self.target_accuracy,
+      "reached": self.reached,
+      "total_tokens": self.trainer._total_train_tokens,
+      "history": self.generative_accuracy_callback.history,
+      "sampler": self.trainer.curriculum_sampler.get_summary()
+    }
+
+    os.makedirs(self.output_dir, exist_ok=True)
+    with open(self.get_summary_path(mode), "w") as f:
+      json.dump(summary, f, indent=2)
+
+    baseline_path = self.get_summary_path("uniform")
+    if mode != "uniform" and os.path.exists(baseline_path):
+      with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+
+      if baseline["reached"] and self.reached:
+        ratio = self.reached["tokens"] / baseline["reached"]["tokens"]
+        print(
+          f"Tokens to {self.target_accuracy:.2%} accuracy: {self.reached['tokens']} ({mode}) vs "
+          f"{baseline['reached']['tokens']} (uniform), {ratio:.2f}x"
+        )
+
+    return control
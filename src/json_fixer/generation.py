@@ -0,0 +1,215 @@
+import argparse
+import copy
+import time
+
+import jsonlines
+import torch
+
+from json_fixer.convert_to_conversation import build_user_prompt
+
+
+def encode_prompts(tokenizer, invalid_jsons: list[str]) -> list[list[int]]:
+  """
+  Chat-template and tokenize the fine-tuning prompt for each input once, so repeated
+  generation over the same inputs can skip the template and tokenizer entirely.
+  """
+  encoded = []
+  for invalid_json in invalid_jsons:
+    conversation = [{"role": "user", "content": build_user_prompt(invalid_json)}]
+    text = tokenizer.apply_chat_template(
+      conversation,
+      tokenize=False,
+      add_generation_prompt=True,
+      enable_thinking=False
+    )
+    encoded.append(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+  return encoded
+
+
+def left_pad(encoded_prompts: list[list[int]], pad_token_id: int, device) -> tuple[torch.Tensor, torch.Tensor]:
+  max_length = max(len(p) for p in encoded_prompts)
+
+  input_ids = torch.full((len(encoded_prompts), max_length), pad_token_id, dtype=torch.long)
+  attention_mask = torch.zeros((len(encoded_prompts), max_length), dtype=torch.long)
+  for i, prompt in enumerate(encoded_prompts):
+    input_ids[i, max_length - len(prompt):] = torch.tensor(prompt, dtype=torch.long)
+    attention_mask[i, max_length - len(prompt):] = 1
+
+  return input_ids.to(device), attention_mask.to(device)
+
+
+def get_shared_prefix(tokenizer) -> list[int]:
+  """
+  Token ids every encoded prompt starts with: the chat-template header plus the instruction.
+  Taken as the common prefix of prompts for inputs with different first characters, so a
+  merge between the instruction's last token and the input is never included.
+  """
+  encoded = encode_prompts(tokenizer, ["{", "[", "a"])
+
+  length = 0
+  while all(length < len(e) for e in encoded) and len({e[length] for e in encoded}) == 1:
+    length += 1
+
+  return encoded[0][:length]
+
+
+class PromptPrefixCache:
+  """
+  KV state of the shared prompt prefix, computed once per model (and once per evaluation
+  when the weights are still changing during training). Each batch gets its own copy
+  expanded to the batch size, so only the per-request suffix is prefilled.
+  """
+  @torch.no_grad()
+  def __init__(self, model, tokenizer):
+    self.prefix_ids = get_shared_prefix(tokenizer)
+    prefix = torch.tensor([self.prefix_ids], dtype=torch.long, device=model.device)
+    self.past_key_values = model(input_ids=prefix, use_cache=True).past_key_values
+
+  def matches(self, encoded_prompts: list[list[int]]) -> bool:
+    n = len(self.prefix_ids)
+
+    return all(len(p) > n and p[:n] == self.prefix_ids for p in encoded_prompts)
+
+  def fork(self, batch_size: int):
+    past_key_values = copy.deepcopy(self.past_key_values)
+    if batch_size > 1:
+      past_key_values.batch_repeat_interleave(batch_size)
+
+    return past_key_values
+
+
+def pad_after_prefix(encoded_prompts: list[list[int]], prefix_length: int, pad_token_id: int, device) -> tuple[torch.Tensor, torch.Tensor]:
+  """
+  Like left_pad, but the padding goes between the shared prefix and each suffix so the
+  cached prefix keeps the same positions for every row. Positions of the suffix tokens come
+  from the attention mask, so the gap doesn't shift them.
+  """
+  suffixes = [p[prefix_length:] for p in encoded_prompts]
+  suffix_ids, suffix_mask = left_pad(suffixes, pad_token_id, device)
+
+  prefix_ids = torch.tensor([encoded_prompts[0][:prefix_length]] * len(encoded_prompts), dtype=torch.long, device=device)
+  prefix_mask = torch.ones_like(prefix_ids)
+
+  return torch.cat([prefix_ids, suffix_ids], dim=1), torch.cat([prefix_mask, suffix_mask], dim=1)
+
+
+@torch.no_grad()
+def generate_batch(model, tokenizer, encoded_prompts: list[list[int]], max_new_tokens: int, prefix_cache: PromptPrefixCache | None = None) -> list[str]:
+  """
+  Greedy-decode a batch of pre-encoded prompts and return the decoded completions. With a
+  `prefix_cache` for this model, the shared prompt prefix is not recomputed.
+  """
+  past_key_values = None
+  if prefix_cache is not None and prefix_cache.matches(encoded_prompts):
+    input_ids, attention_mask = pad_after_prefix(encoded_prompts, len(prefix_cache.prefix_ids), tokenizer.pad_token_id, model.device)
+    past_key_values = prefix_cache.fork(len(encoded_prompts))
+  else:
+    input_ids, attention_mask = left_pad(encoded_prompts, tokenizer.pad_token_id, model.device)
+
+  output_ids = model.generate(
+    input_ids=input_ids,
+    attention_mask=attention_mask,
+    max_new_tokens=max_new_tokens,
+    do_sample=False,
+    use_cache=True,
+    past_key_values=past_key_values,
+    pad_token_id=tokenizer.pad_token_id
+  )
+
+  return tokenizer.batch_decode(output_ids[:, input_ids.shape[1]:], skip_special_tokens=True)
+
+
+def synchronize(device):
+  if device.type == "xpu":
+    torch.xpu.synchronize()
+  elif device.type == "cuda":
+    torch.cuda.synchronize()
+
+
+@torch.no_grad()
+def measure_prefill(model, tokenizer, encoded_prompts: list[list[int]], prefix_cache: PromptPrefixCache, batch_size: int, repeat: int = 3) -> dict:
+  """
+  Time the prefill forward pass over `encoded_prompts` in batches, once recomputing the
+  whole prompt and once starting from a fork of the cached prefix (fork cost included).
+  """
+  def prefill(batch: list[list[int]], cached: bool):
+    if cached:
+      input_ids, attention_mask = pad_after_prefix(batch, len(prefix_cache.prefix_ids), tokenizer.pad_token_id, model.device)
+      past_key_values = prefix_cache.fork(len(batch))
+      past_length = len(prefix_cache.prefix_ids)
+      position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, past_length:]
+      model(
+        input_ids=input_ids[:, past_length:],
+        attention_mask=attention_mask,
+        position_ids=position_ids,
+        past_key_values=past_key_values,
+        use_cache=True
+      )
+    else:
+      input_ids, attention_mask = left_pad(batch, tokenizer.pad_token_id, model.device)
+      model(input_ids=input_ids, attention_mask=attention_mask, use_cache=True)
+
+  timings = {}
+  for cached in [False, True]:
+    best = None
+    for _ in range(repeat + 1):
+      synchronize(model.device)
+      start = time.perf_counter()
+      for i in range(0, len(encoded_prompts), batch_size):
+        prefill(encoded_prompts[i:i + batch_size], cached)
+      synchronize(model.device)
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+    timings["cached_prefix_s" if cached else "full_prompt_s"] = best
+
+  prompt_tokens = sum(len(p) for p in encoded_prompts)
+  timings["prefix_tokens"] = len(prefix_cache.prefix_ids)
+  timings["prefix_share"] = len(prefix_cache.prefix_ids) * len(encoded_prompts) / prompt_tokens
+  timings["reduction"] = 1.0 - timings["cached_prefix_s"] / timings["full_prompt_s"]
+
+  return timings
+
+
+if __name__ == "__main__":
+  from transformers import AutoModelForCausalLM, AutoTokenizer
+
+  from json_fixer.training_config import fine_tuned_model_id, eval_dataset_path
+  from utils.example_tags import get_payload_size
+
+  parser = argparse.ArgumentParser(description="Measure prefill time with and without the cached prompt prefix.")
+  parser.add_argument("--model", default=fine_tuned_model_id)
+  parser.add_argument("--dataset", default=eval_dataset_path)
+  parser.add_argument("--device", default="xpu" if hasattr(torch, "xpu") and torch.xpu.is_available() else "cpu")
+  parser.add_argument("--batch-size", type=int, default=8)
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+
+  tokenizer = AutoTokenizer.from_pretrained(args.model)
+  if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+
+  model = AutoModelForCausalLM.from_pretrained(
+    args.model,
+    torch_dtype=torch.bfloat16 if args.device != "cpu" else torch.float32
+  ).to(args.device)
+  model.eval()
+
+  with jsonlines.open(args.dataset) as j:
+    dataset = list(j)
+
+  prefix_cache = PromptPrefixCache(model, tokenizer)
+
+  # The prefix is a larger share of small prompts, so report payload sizes separately.
+  by_size = {}
+  for example in dataset:
+    by_size.setdefault(get_payload_size(example["fixed_json"]), []).append(example["invalid_json"])
+
+  for size, invalid_jsons in sorted(by_size.items()):
+    timings = measure_prefill(model, tokenizer, encode_prompts(tokenizer, invalid_jsons), prefix_cache, args.batch_size, args.repeat)
+    print(
+      f"{size:<8} n={len(invalid_jsons):<5} prefix {timings['prefix_tokens']} tokens "
+      f"({timings['prefix_share']:.1%} of prompt tokens): "
+      f"full {timings['full_prompt_s'] * 1000:.1f} ms, cached prefix {timings['cached_prefix_s'] * 1000:.1f} ms "
+      f"({timings['reduction']:.1%} less)"
+    )
@@ -0,0 +1,103 @@
+import random
+
+from transformers import TrainerCallback
+
+from json_fixer.generation import PromptPrefixCache, encode_prompts, generate_batch
+from utils.json_compare import matches_ground_truth
+
+
+def select_eval_subset(eval_examples: list[dict], num_examples: int, seed: int = 42) -> list[dict]:
+  if num_examples < len(eval_examples):
+    return random.Random(seed).sample(eval_examples, num_examples)
+
+  return eval_examples
+
+
+class GenerativeAccuracyCallback(TrainerCallback):
+  """
+  Every `eval_steps` optimizer steps, greedily generate fixes for a fixed subset of the eval
+  set and score them with the same exact-match comparison as model_eval.py. Training stops
+  once accuracy hasn't improved by more than `min_delta` for `patience` evaluations.
+  """
+  def __init__(
+    self,
+    tokenizer,
+    eval_examples: list[dict],
+    eval_steps: int,
+    num_examples: int,
+    batch_size: int,
+    max_new_tokens: int,
+    patience: int,
+    min_delta: float = 0.0,
+    seed: int = 42
+  ):
+    self.tokenizer = tokenizer
+    self.eval_steps = eval_steps
+    self.batch_size = batch_size
+    self.max_new_tokens = max_new_tokens
+    self.patience = patience
+    self.min_delta = min_delta
+
+    subset = select_eval_subset(eval_examples, num_examples, seed)
+
+    self.ground_truths = [example["fixed_json"] for example in subset]
+    # Encoded once up-front; every evaluation reuses the same prompt token ids.
+    self.encoded_prompts = encode_prompts(tokenizer, [example["invalid_json"] for example in subset])
+
+    self.best_accuracy = None
+    self.evaluations_without_improvement = 0
+    self.history = []
+
+  def evaluate(self, model) -> float:
+    was_training = model.training
+    model.eval()
+
+    # The weights change between evaluations, so the prefix KV state is rebuilt each time
+    # and shared by all batches of this evaluation.
+    prefix_cache = PromptPrefixCache(model, self.tokenizer)
+
+    score = 0
+    for start in range(0, len(self.encoded_prompts), self.batch_size):
+      completions = generate_batch(
+        model,
+        self.tokenizer,
+        self.encoded_prompts[start:start + self.batch_size],
+        self.max_new_tokens,
+        prefix_cache
+      )
+      for completion, ground_truth in zip(completions, self.ground_truths[start:start + self.batch_size]):
+        if matches_ground_truth(completion, ground_truth):
+          score += 1
+
+    if was_training:
+      model.train()
+
+    return float(score) / len(self.encoded_prompts)
+
+  def on_step_end(self, args, state, control, model=None, **kwargs):
+    if state.global_step == 0 or state.global_step % self.eval_steps != 0:
+      return control
+
+    accuracy = self.evaluate(model)
+    self.history.append({"step": state.global_step, "accuracy": accuracy})
+    state.log_history.append({
+      "step": state.global_step,
+      "epoch": state.epoch,
+      "eval_generative_accuracy": accuracy
+    })
+    print(f"Step {state.global_step}: generative accuracy {accuracy:.4f}")
+
+    if self.best_accuracy is None or accuracy > self.best_accuracy + self.min_delta:
+      self.best_accuracy = accuracy
+      self.evaluations_without_improvement = 0
+    else:
+      self.evaluations_without_improvement += 1
+
+    if self.evaluations_without_improvement >= self.patience:
+      print(
+        f"Generative accuracy has not improved on {self.best_accuracy:.4f} "
+        f"for {self.patience} evaluations. Stopping training."
+      )
+      control.should_training_stop = True
+
+    return control
@@ -0,0 +1,448 @@
+import argparse
+import json
+import os
+import platform
+import time
+
+import jsonlines
+
+from json_fixer.convert_to_conversation import convert_to_conversation
+from json_fixer.token_profiler import append_eos
+from json_fixer.training_config import (
+  training_configuration,
+  model_id,
+  train_dataset_path,
+  eval_dataset_path,
+  create_lora_config
+)
+
+# Keep some headroom for allocator fragmentation and the occasional longer-than-profiled batch.
+default_safety_margin = 0.1
+default_profile_steps = 3
+default_length_percentiles = [50, 90, 100]
+
+# AdamW keeps two fp32 moments per trainable parameter.
+adam_state_bytes_per_param = 8
+
+
+def get_plan_mismatches(plan: dict, configuration: dict, device_info: dict) -> list[str]:
+  """
+  Settings the plan was made for that differ from the current config or device. A plan is
+  only valid for the model, effective batch size, sequence length and device it profiled.
+  """
+  expected = {
+    "model_id": model_id,
+    "effective_batch_size": get_effective_batch_size(configuration),
+    "max_length": configuration["train"]["max_length"],
+    "generative_eval_batch_size": configuration["generative_eval"]["batch_size"],
+    "generative_eval_max_new_tokens": configuration["generative_eval"]["max_new_tokens"],
+    "curriculum_mode": configuration["curriculum"]["mode"],
+    **device_info
+  }
+
+  return [
+    f"{key}: plan has {plan.get(key)!r}, current is {value!r}"
+    for key, value in expected.items() if plan.get(key) != value
+  ]
+
+
+def apply_memory_plan(configuration: dict, plan_path: str | None = None, device: str | None = None) -> dict | None:
+  """
+  Overwrite the batch size, gradient accumulation and gradient checkpointing settings in
+  `configuration["train"]` with the ones stored in a plan written by this module.
+
+  Returns the plan, or None if there is no plan on disk or it was made for a different
+  model, config or device, in which case the configuration is left untouched.
+  """
+  plan_path = plan_path or configuration["train"]["memory_plan_path"]
+  if not os.path.exists(plan_path):
+    return None
+
+  with open(plan_path, "r") as f:
+    plan = json.load(f)
+
+  mismatches = get_plan_mismatches(plan, configuration, get_device_info(device or get_default_device()))
+  if mismatches:
+    print(f"Ignoring memory plan {plan_path}, it was made for a different setup. Re-run memory_planner.py.")
+    for mismatch in mismatches:
+      print(f"  {mismatch}")
+    return None
+
+  train = configuration["train"]
+  train["per_device_train_batch_size"] = plan["per_device_train_batch_size"]
+  train["gradient_accumulation_steps"] = plan["gradient_accumulation_steps"]
+  train["gradient_checkpointing"] = plan["gradient_checkpointing"]
+
+  print(
+    f"Using memory plan from {plan_path}: "
+    f"batch size {plan['per_device_train_batch_size']}, "
+    f"gradient accumulation {plan['gradient_accumulation_steps']}, "
+    f"gradient checkpointing {plan['gradient_checkpointing']}"
+  )
+
+  return plan
+
+
+def get_effective_batch_size(configuration: dict) -> int:
+  train = configuration["train"]
+
+  return train["per_device_train_batch_size"] * train["gradient_accumulation_steps"]
+
+
+def get_candidate_batch_sizes(effective_batch_size: int) -> list[int]:
+  # Only batch sizes that divide the effective batch size keep it constant.
+  return [b for b in range(effective_batch_size, 0, -1) if effective_batch_size % b == 0]
+
+
+def tokenize_example(tokenizer, example: dict, max_length: int) -> list[int]:
+  conversation = convert_to_conversation(example)["conversations"]
+  text = append_eos(tokenizer, tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=False))
+
+  return tokenizer(text, add_special_tokens=False)["input_ids"][:max_length]
+
+
+def get_representative_examples(tokenizer, dataset: list[dict], max_length: int, percentiles: list[int], lengths: list[dict] | None = None) -> list[list[int]]:
+  """
+  Return the token ids of the examples sitting at the given length percentiles (truncated
+  to `max_length`, as the trainer would). With cached `lengths` from token_profiler.py only
+  the selected examples get tokenized.
+  """
+  if lengths is None:
+    lengths = [{"total_tokens": len(tokenize_example(tokenizer, example, max_length))} for example in dataset]
+
+  order = sorted(range(len(dataset)), key=lambda i: lengths[i]["total_tokens"])
+
+  representative = []
+  for p in percentiles:
+    idx = order[min(len(order) - 1, (len(order) * p) // 100)]
+    representative.append(tokenize_example(tokenizer, dataset[idx], max_length))
+
+  return representative
+
+
+class SavedActivationTracker:
+  """
+  Simulates device memory on CPU by counting the bytes of tensors autograd saves for the
+  backward pass. Tensors recomputed by non-reentrant gradient checkpointing are never
+  handed to these hooks, so the savings from checkpointing show up here as well.
+  """
+  def __init__(self):
+    self.current_bytes = 0
+    self.peak_bytes = 0
+
+  def pack(self, tensor):
+    size = tensor.numel() * tensor.element_size()
+    self.current_bytes += size
+    self.peak_bytes = max(self.peak_bytes, self.current_bytes)
+
+    return (tensor, size)
+
+  def unpack(self, packed):
+    tensor, _ = packed
+
+    return tensor
+
+
+def get_static_memory_bytes(model) -> int:
+  """Weights, gradients and optimizer state - everything that doesn't scale with the batch."""
+  total = 0
+  for param in model.parameters():
+    total += param.numel() * param.element_size()
+    if param.requires_grad:
+      total += param.numel() * param.element_size()
+      total += param.numel() * adam_state_bytes_per_param
+
+  return total
+
+
+def get_generation_reserve_bytes(model, batch_size: int, max_sequence_length: int) -> int:
+  """
+  KV cache of the generative-accuracy eval that runs in the training process: `batch_size`
+  rows of up to `max_sequence_length` keys and values in every layer.
+  """
+  config = model.config
+  num_kv_heads = getattr(config, "num_key_value_heads", None) or config.num_attention_heads
+  head_dim = getattr(config, "head_dim", None) or config.hidden_size // config.num_attention_heads
+  dtype_bytes = next(model.parameters()).element_size()
+
+  return 2 * config.num_hidden_layers * num_kv_heads * head_dim * dtype_bytes * batch_size * max_sequence_length
+
+
+def get_device_module(device: str):
+  import torch
+
+  if device == "xpu":
+    return torch.xpu
+  if device == "cuda":
+    return torch.cuda
+
+  return None
+
+
+def get_transient_loss_bytes(logits, per_example_loss: bool) -> int:
+  """
+  Memory the saved-tensor hooks don't see on CPU: the logits the model returns, plus one
+  fp32 chunk of them and its log-softmax while get_per_example_loss runs.
+  """
+  from json_fixer.curriculum import loss_chunk_size
+
+  logits_bytes = logits.numel() * logits.element_size()
+  if not per_example_loss:
+    return logits_bytes
+
+  batch_size, sequence_length, vocab_size = logits.shape
+  chunk_bytes = batch_size * min(loss_chunk_size, sequence_length - 1) * vocab_size * 4
+
+  return logits_bytes + 2 * chunk_bytes
+
+
+def profile_step(model, input_ids: list[int], batch_size: int, gradient_checkpointing: bool, device: str, steps: int, per_example_loss: bool = False) -> dict:
+  """
+  Run `steps` forward/backward passes on a batch made of `input_ids` repeated `batch_size`
+  times and report peak memory and throughput. With `per_example_loss`, also run the
+  curriculum's per-example loss like the trainer does in "loss" mode. Returns {"oom": True}
+  if the device ran out.
+  """
+  import torch
+
+  from json_fixer.curriculum import get_per_example_loss
+
+  if gradient_checkpointing:
+    model.gradient_checkpointing_enable(gradient_checkpointing_kwargs={"use_reentrant": False})
+  else:
+    model.gradient_checkpointing_disable()
+  model.train()
+
+  batch = torch.tensor([input_ids] * batch_size, device=device)
+  device_module = get_device_module(device)
+  tracker = SavedActivationTracker()
+
+  if device_module is not None:
+    device_module.empty_cache()
+    device_module.reset_peak_memory_stats()
+
+  try:
+    elapsed = 0.0
+    for step in range(steps + 1):
+      start = time.perf_counter()
+      with torch.autograd.graph.saved_tensors_hooks(tracker.pack, tracker.unpack):
+        outputs = model(input_ids=batch, labels=batch)
+      # In "loss" mode CurriculumSFTTrainer computes per-example losses from the logits on
+      # every training step, so include that in the measured peak.
+      if per_example_loss:
+        get_per_example_loss(outputs.logits, batch)
+      transient_bytes = get_transient_loss_bytes(outputs.logits, per_example_loss)
+      outputs.loss.backward()
+      del outputs
+      model.zero_grad(set_to_none=True)
+      if device_module is not None:
+        device_module.synchronize()
+
+      # The first step warms up kernels and the allocator; don't time it.
+      if step > 0:
+        elapsed += time.perf_counter() - start
+      tracker.current_bytes = 0
+  except torch.OutOfMemoryError:
+    model.zero_grad(set_to_none=True)
+    if device_module is not None:
+      device_module.empty_cache()
+
+    return {"oom": True}
+
+  if device_module is not None:
+    peak_bytes = device_module.max_memory_allocated()
+  else:
+    peak_bytes = get_static_memory_bytes(model) + tracker.peak_bytes + transient_bytes
+
+  return {
+    "oom": False,
+    "peak_memory_bytes": peak_bytes,
+    "tokens_per_second": (batch_size * len(input_ids) * steps) / elapsed
+  }
+
+
+def profile_configuration(model, examples: list[list[int]], batch_size: int, gradient_checkpointing: bool, device: str, budget_bytes: int, steps: int, per_example_loss: bool = False) -> dict:
+  measurements = []
+  for input_ids in examples:
+    result = profile_step(model, input_ids, batch_size, gradient_checkpointing, device, steps, per_example_loss)
+    fits = not result["oom"] and result["peak_memory_bytes"] <= budget_bytes
+    measurements.append({"sequence_length": len(input_ids), **result})
+
+    # Longer sequences only need more memory, no point profiling them.
+    if not fits:
+      return {"fits": False, "measurements": measurements}
+
+  total_tokens = sum(m["sequence_length"] for m in measurements)
+
+  return {
+    "fits": True,
+    "measurements": measurements,
+    "peak_memory_bytes": max(m["peak_memory_bytes"] for m in measurements),
+    # Length-weighted, so the number reflects the mix of sequence lengths profiled.
+    "tokens_per_second": sum(m["tokens_per_second"] * m["sequence_length"] for m in measurements) / total_tokens
+  }
+
+
+def get_max_eval_prompt_tokens(tokenizer, eval_dataset: list[dict]) -> int:
+  """Longest prompt GenerativeAccuracyCallback will generate from, encoded the same way."""
+  from json_fixer.generation import encode_prompts
+  from json_fixer.generative_eval_callback import select_eval_subset
+
+  subset = select_eval_subset(eval_dataset, training_configuration["generative_eval"]["num_examples"])
+
+  return max(len(p) for p in encode_prompts(tokenizer, [example["invalid_json"] for example in subset]))
+
+
+def create_memory_plan(model, tokenizer, dataset: list[dict], eval_dataset: list[dict], device: str, memory_budget_bytes: int, safety_margin: float = default_safety_margin, steps: int = default_profile_steps, percentiles: list[int] = default_length_percentiles, lengths: list[dict] | None = None) -> dict:
+  """
+  Pick the largest per-device batch size that fits in the memory budget while keeping the
+  effective batch size of `training_configuration` constant. Gradient checkpointing is only
+  turned on when that batch size doesn't fit without it. `eval_dataset` is the split the
+  generative-accuracy eval draws its prompts from.
+  """
+  max_length = training_configuration["train"]["max_length"]
+  effective_batch_size = get_effective_batch_size(training_configuration)
+  generative_eval = training_configuration["generative_eval"]
+  curriculum_mode = training_configuration["curriculum"]["mode"]
+
+  # The caching allocator keeps the training step's blocks around while the generative eval
+  # runs, so its KV cache is reserved on top rather than assumed to reuse activation memory.
+  max_prompt_tokens = get_max_eval_prompt_tokens(tokenizer, eval_dataset)
+  generation_reserve_bytes = get_generation_reserve_bytes(
+    model,
+    generative_eval["batch_size"],
+    max_prompt_tokens + generative_eval["max_new_tokens"]
+  )
+  budget_bytes = int(memory_budget_bytes * (1.0 - safety_margin)) - generation_reserve_bytes
+  if budget_bytes <= 0:
+    raise RuntimeError(
+      f"The generative eval's KV cache alone ({generation_reserve_bytes} bytes) does not fit in "
+      f"{memory_budget_bytes} bytes. Lower generative_eval batch_size or max_new_tokens."
+    )
+
+  examples = get_representative_examples(tokenizer, dataset, max_length, percentiles, lengths)
+  candidates = []
+
+  for batch_size in get_candidate_batch_sizes(effective_batch_size):
+    for gradient_checkpointing in [False, True]:
+      print(f"Profiling batch size {batch_size}, gradient checkpointing {gradient_checkpointing}...")
+      result = profile_configuration(model, examples, batch_size, gradient_checkpointing, device, budget_bytes, steps, curriculum_mode == "loss")
+      candidates.append({
+        "per_device_train_batch_size": batch_size,
+        "gradient_checkpointing": gradient_checkpointing,
+        **result
+      })
+
+      if result["fits"]:
+        return {
+          "model_id": model_id,
+          **get_device_info(device),
+          "memory_budget_bytes": memory_budget_bytes,
+          "safety_margin": safety_margin,
+          "max_length": max_length,
+          "effective_batch_size": effective_batch_size,
+          "generative_eval_batch_size": generative_eval["batch_size"],
+          "generative_eval_max_new_tokens": generative_eval["max_new_tokens"],
+          "generation_reserve_bytes": generation_reserve_bytes,
+          "curriculum_mode": curriculum_mode,
+          "per_device_train_batch_size": batch_size,
+          "gradient_accumulation_steps": effective_batch_size // batch_size,
+          "gradient_checkpointing": gradient_checkpointing,
+          "sequence_lengths": [len(e) for e in examples],
+          "peak_memory_bytes": result["peak_memory_bytes"],
+          "tokens_per_second": result["tokens_per_second"],
+          "candidates": candidates
+        }
+
+  raise RuntimeError(
+    f"Even a batch size of 1 with gradient checkpointing does not fit in {memory_budget_bytes} bytes."
+  )
+
+
+def get_default_device() -> str:
+  import torch
+
+  if hasattr(torch, "xpu") and torch.xpu.is_available():
+    return "xpu"
+  if torch.cuda.is_available():
+    return "cuda"
+
+  return "cpu"
+
+
+def get_device_info(device: str) -> dict:
+  device_module = get_device_module(device)
+  if device_module is None:
+    return {"device": device, "device_name": platform.processor() or platform.machine(), "device_total_memory_bytes": None}
+
+  properties = device_module.get_device_properties(0)
+
+  return {"device": device, "device_name": properties.name, "device_total_memory_bytes": properties.total_memory}
+
+
+def get_device_memory_bytes(device: str) -> int:
+  total_memory_bytes = get_device_info(device)["device_total_memory_bytes"]
+  if total_memory_bytes is None:
+    raise ValueError("A --memory-budget-gb is required when planning on CPU.")
+
+  return total_memory_bytes
+
+
+if __name__ == "__main__":
+  import torch
+  from peft import get_peft_model
+  from transformers import AutoModelForCausalLM, AutoTokenizer
+
+  from json_fixer.token_profiler import load_token_lengths
+
+  parser = argparse.ArgumentParser(description="Plan batch size, gradient accumulation and checkpointing for a memory budget.")
+  parser.add_argument("--dataset", default=train_dataset_path)
+  parser.add_argument("--eval-dataset", default=eval_dataset_path, help="Split the generative-accuracy eval generates from, to size its KV cache.")
+  parser.add_argument("--device", default=None, help="xpu, cuda or cpu (simulated budget). Defaults to the available accelerator.")
+  parser.add_argument("--memory-budget-gb", type=float, default=None, help="Defaults to the total memory of the device.")
+  parser.add_argument("--safety-margin", type=float, default=default_safety_margin)
+  parser.add_argument("--steps", type=int, default=default_profile_steps)
+  parser.add_argument("--output", default=training_configuration["train"]["memory_plan_path"])
+  args = parser.parse_args()
+
+  device = args.device or get_default_device()
+  if args.memory_budget_gb is not None:
+    memory_budget_bytes = int(args.memory_budget_gb * 1024**3)
+  else:
+    memory_budget_bytes = get_device_memory_bytes(device)
+
+  with jsonlines.open(args.dataset) as j:
+    dataset = list(j)
+
+  with jsonlines.open(args.eval_dataset) as j:
+    eval_dataset = list(j)
+
+  tokenizer = AutoTokenizer.from_pretrained(model_id)
+  model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.bfloat16)
+  model.enable_input_require_grads()
+  model = get_peft_model(model, create_lora_config()).to(device)
+
+  plan = create_memory_plan(
+    model,
+    tokenizer,
+    dataset,
+    eval_dataset,
+    device,
+    memory_budget_bytes,
+    safety_margin=args.safety_margin,
+    steps=args.steps,
+    lengths=load_token_lengths(args.dataset)
+  )
+
+  with open(args.output, "w") as f:
+    json.dump(plan, f, indent=2)
+
+  print(
+    f"Plan: batch size {plan['per_device_train_batch_size']} x "
+    f"{plan['gradient_accumulation_steps']} accumulation steps, "
+    f"gradient checkpointing {plan['gradient_checkpointing']}, "
+    f"{plan['tokens_per_second']:.1f} tokens/s, "
+    f"peak {plan['peak_memory_bytes'] / 1024**3:.2f} GiB "
+    f"(+{plan['generation_reserve_bytes'] / 1024**3:.2f} GiB reserved for the generative eval)"
+  )
+  print(f"Wrote plan to {args.output}")
@@ -1,15 +1,26 @@
+import os
+import time
 import openai
 import jsonlines
-import json
 from openai.types.chat import ChatCompletion
-from utils.clean_message import clean_message
-from utils.strip_think_tags import strip_think_tags
+from utils.completion_cache import CompletionCache, get_model_key
+from utils.json_compare import matches_ground_truth
+from utils.outcome_log import record_outcome
 
 test_dataset_file = "/home/rngo/code/intel-gpu-fine-tune/dataset/test_data.jsonl"
 
 base_api_url = "http://192.168.1.36:8000/v1"
 api_key = "none"
 model = "Qwen3-0.6B"
+# Local copy of the served weights. When set, cached completions are tied to this exact
+# checkpoint instead of just the served model name. Set it whenever a retrained model is
+# served under the same name, otherwise the old completions are reused.
+model_checkpoint_path = None
+completion_cache_path = "model_eval_cache.sqlite"
+# Every run writes its scored examples to a new file here for
+# data_processing/hard_example_mining.py, which keeps only the latest outcome per input.
+outcome_log_dir = "eval_outcomes"
+sampling_params = {"temperature": 0.01}
 
 client: openai.Client = openai.Client(
   base_url=base_api_url,
@@ -19,32 +30,50 @@ client: openai.Client = openai.Client(
 with jsonlines.open(test_dataset_file, "r") as j:
   data = list(j)
 
+completion_cache = CompletionCache(completion_cache_path)
+model_key = get_model_key(model, model_checkpoint_path)
+
+os.makedirs(outcome_log_dir, exist_ok=True)
+outcome_log_path = os.path.join(outcome_log_dir, f"{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+
 score = 0
 for example in data:
   input = example["invalid_json"]
 
   user_prompt = f"/no_think only output JSON. fix this JSON: {input}" if model == "Qwen3-0.6B" else f"fix this JSON: {input}"
 
-  response: ChatCompletion = client.chat.completions.create(
-    model=model,
-    messages=[
-      {"role": "user", "content": user_prompt}
-    ],
-    temperature=0.01
-  )
-
-  assistant_message = response.choices[0].message.content
-  try:
-    assistant_message = clean_message(assistant_message)
-    assistant_message_deserialized = json.loads(assistant_message)
-    assistant_message_prettified = json.dumps(assistant_message_deserialized, indent=2)
-
-    ground_truth = json.dumps(json.loads(example["fixed_json"]), indent=2)
-    if assistant_message_prettified == ground_truth:
-      score += 1
-    else:
-      print(f"{assistant_message} did not match ground truth: {ground_truth}")
-  except:
-    print(f"{assistant_message} did not match ground truth: {ground_truth}")
+  messages = [
+    {"role": "user", "content": user_prompt}
+  ]
+
+  # Only (model, example) pairs that haven't been seen before hit the server, so rescoring
+  # after changing clean_message or the comparison is effectively free.
+  assistant_message = completion_cache.get(model_key, messages, sampling_params)
+  if assistant_message is None:
+    response: ChatCompletion = client.chat.completions.create(
+      model=model,
+      messages=messages,
+      **sampling_params
+    )
+
+    assistant_message = response.choices[0].message.content
+    completion_cache.put(model_key, messages, sampling_params, assistant_message)
+
+  passed = assistant_message is not None and matches_ground_truth(assistant_message, example["fixed_json"])
+  record_outcome(outcome_log_path, "test", input, passed, fixed_json=example["fixed_json"], model=model_key)
+
+  if passed:
+    score += 1
+  else:
+    print(f"{assistant_message} did not match ground truth: {example['fixed_json']}")
+
+cache_stats = completion_cache.stats()
+print(
+  f"Completion cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+  f"({cache_stats['hit_rate']:.1%} hit rate), {cache_stats['evictions']} evictions, "
+  f"{cache_stats['entries']} entries / {cache_stats['size_bytes']} bytes"
+)
+completion_cache.close()
 
+print(f"Wrote outcomes to {outcome_log_path}")
 print(f"Final score for test set: {float(1.0*score) / len(data)}")
\ No newline at end of file
@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import bisect
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from json_fixer.generation import PromptPrefixCache, encode_prompts, generate_batch
+from json_fixer.training_config import fine_tuned_model_id
+from utils.clean_message import clean_message
+from utils.completion_cache import get_model_key
+from utils.json_pretty import prettify_json
+from utils.outcome_log import record_outcome
+
+default_max_batch_size = 8
+default_max_wait_ms = 10.0
+default_max_new_tokens = 2048
+default_cache_size = 1024
+
+latency_buckets_ms = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+batch_size_buckets = [1, 2, 4, 8, 16, 32, 64]
+
+
+class Histogram:
+  """Cumulative-bucket histogram, in the same shape Prometheus uses."""
+  def __init__(self, buckets: list[float]):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.total = 0
+    self.sum = 0.0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.total += 1
+    self.sum += value
+
+  def to_dict(self) -> dict:
+    cumulative = 0
+    buckets = {}
+    for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+      cumulative += count
+      buckets[str(bound)] = cumulative
+
+    return {"buckets": buckets, "count": self.total, "sum": self.sum}
+
+
+class LRUCache:
+  def __init__(self, max_size: int):
+    self.max_size = max_size
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    if key not in self.entries:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self.entries.move_to_end(key)
+
+    return self.entries[key]
+
+  def put(self, key, value):
+    if self.max_size <= 0:
+      return
+
+    self.entries[key] = value
+    self.entries.move_to_end(key)
+    if len(self.entries) > self.max_size:
+      self.entries.popitem(last=False)
+
+
+def normalize_input(invalid_json: str) -> str:
+  # Whitespace inside the payload can be the very thing that needs fixing (literal newlines
+  # in strings), so only normalize line endings and the surrounding whitespace.
+  return invalid_json.replace("\r\n", "\n").strip()
+
+
+def postprocess(completion: str) -> str:
+  """Raises ValueError (or IndexError) when the model didn't produce valid JSON."""
+  return prettify_json(clean_message(completion))
+
+
+class MicroBatcher:
+  """
+  Groups concurrent requests into batches of at most `max_batch_size`, waiting no longer
+  than `max_wait_ms` after the first request of a batch arrives for more to show up.
+  Batches run one at a time on a single worker thread so the model is never shared.
+  """
+  def __init__(self, model, tokenizer, max_batch_size: int, max_wait_ms: float, max_new_tokens: int):
+    self.model = model
+    self.tokenizer = tokenizer
+    self.max_batch_size = max_batch_size
+    self.max_wait_ms = max_wait_ms
+    self.max_new_tokens = max_new_tokens
+    # Built lazily on the worker thread so startup doesn't block the event loop.
+    self.prefix_cache: PromptPrefixCache | None = None
+
+    self.queue: asyncio.Queue = asyncio.Queue()
+    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.worker: asyncio.Task | None = None
+
+    self.batch_size_histogram = Histogram(batch_size_buckets)
+    self.batch_latency_histogram = Histogram(latency_buckets_ms)
+
+  def start(self):
+    self.worker = asyncio.create_task(self.run())
+
+  async def stop(self):
+    if self.worker is not None:
+      self.worker.cancel()
+    self.executor.shutdown(wait=False)
+
+  def queue_depth(self) -> int:
+    return self.queue.qsize()
+
+  async def submit(self, invalid_json: str) -> str:
+    future = asyncio.get_running_loop().create_future()
+    await self.queue.put((invalid_json, future))
+
+    return await future
+
+  async def collect_batch(self) -> list:
+    batch = [await self.queue.get()]
+    deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+
+    while len(batch) < self.max_batch_size:
+      remaining = deadline - time.perf_counter()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+      except asyncio.TimeoutError:
+        break
+
+    return batch
+
+  def generate(self, invalid_jsons: list[str]) -> list[str]:
+    if self.prefix_cache is None:
+      self.prefix_cache = PromptPrefixCache(self.model, self.tokenizer)
+
+    return generate_batch(
+      self.model,
+      self.tokenizer,
+      encode_prompts(self.tokenizer, invalid_jsons),
+      self.max_new_tokens,
+      self.prefix_cache
+    )
+
+  async def run(self):
+    loop = asyncio.get_running_loop()
+
+    while True:
+      batch = await self.collect_batch()
+      self.batch_size_histogram.observe(len(batch))
+
+      start = time.perf_counter()
+      try:
+        completions = await loop.run_in_executor(self.executor, self.generate, [invalid_json for invalid_json, _ in batch])
+      except Exception as e:
+        for _, future in batch:
+          if not future.done():
+            future.set_exception(e)
+        continue
+      finally:
+        self.batch_latency_histogram.observe((time.perf_counter() - start) * 1000.0)
+
+      for (_, future), completion in zip(batch, completions):
+        if not future.done():
+          future.set_result(completion)
+
+
+def create_app(model, tokenizer, max_batch_size: int = default_max_batch_size, max_wait_ms: float = default_max_wait_ms, max_new_tokens: int = default_max_new_tokens, cache_size: int = default_cache_size, outcome_log_path: str | None = None, model_key: str | None = None) -> web.Application:
+  app = web.Application()
+  # Tagging and appending outcomes happen on their own thread, off the event loop and out of
+  # the model's way. One worker keeps the writes to the log in order.
+  outcome_executor = ThreadPoolExecutor(max_workers=1)
+  cache = LRUCache(cache_size)
+  request_latency_histogram = Histogram(latency_buckets_ms)
+  batcher = MicroBatcher(model, tokenizer, max_batch_size, max_wait_ms, max_new_tokens)
+
+  def log_outcome(invalid_json: str, passed: bool):
+    # "passed" here only means the output parsed; hard_example_mining.py keeps production
+    # outcomes apart from exact-match test outcomes.
+    if outcome_log_path:
+      future = asyncio.get_running_loop().run_in_executor(outcome_executor, record_outcome, outcome_log_path, "production", invalid_json, passed, None, model_key)
+      future.add_done_callback(report_outcome_error)
+
+  def report_outcome_error(future: asyncio.Future):
+    # Nothing awaits the write, so surface failures here instead of losing them.
+    if not future.cancelled() and future.exception() is not None:
+      print(f"Failed to record outcome to {outcome_log_path}: {future.exception()!r}")
+
+  async def fix(request: web.Request) -> web.Response:
+    start = time.perf_counter()
+
+    try:
+      body = await request.json()
+      invalid_json = body["invalid_json"]
+      if not isinstance(invalid_json, str):
+        raise TypeError("invalid_json must be a string")
+    except Exception:
+      return web.json_response({"error": "Expected a JSON body with an \"invalid_json\" string."}, status=400)
+
+    key = normalize_input(invalid_json)
+    fixed_json = cache.get(key)
+    cached = fixed_json is not None
+
+    if not cached:
+      completion = await batcher.submit(key)
+      try:
+        fixed_json = postprocess(completion)
+      except (ValueError, IndexError) as e:
+        log_outcome(key, False)
+        request_latency_histogram.observe((time.perf_counter() - start) * 1000.0)
+        return web.json_response({"error": str(e), "completion": completion}, status=422)
+      log_outcome(key, True)
+      cache.put(key, fixed_json)
+
+    request_latency_histogram.observe((time.perf_counter() - start) * 1000.0)
+
+    return web.json_response({"fixed_json": fixed_json, "cached": cached})
+
+  async def metrics(request: web.Request) -> web.Response:
+    return web.json_response({
+      "queue_depth": batcher.queue_depth(),
+      "batch_size": batcher.batch_size_histogram.to_dict(),
+      "batch_latency_ms": batcher.batch_latency_histogram.to_dict(),
+      "request_latency_ms": request_latency_histogram.to_dict(),
+      "cache": {"hits": cache.hits, "misses": cache.misses, "entries": len(cache.entries)}
+    })
+
+  async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+  async def on_startup(app: web.Application):
+    batcher.start()
+
+  async def on_cleanup(app: web.Application):
+    await batcher.stop()
+    outcome_executor.shutdown(wait=True)
+
+  app.router.add_post("/fix", fix)
+  app.router.add_get("/metrics", metrics)
+  app.router.add_get("/health", health)
+  app.on_startup.append(on_startup)
+  app.on_cleanup.append(on_cleanup)
+
+  return app
+
+
+if __name__ == "__main__":
+  import torch
+  from transformers import AutoModelForCausalLM, AutoTokenizer
+
+  parser = argparse.ArgumentParser(description="Serve the fine-tuned JSON fixer over HTTP with dynamic micro-batching.")
+  parser.add_argument("--model", default=fine_tuned_model_id)
+  parser.add_argument("--device", default="xpu" if hasattr(torch, "xpu") and torch.xpu.is_available() else "cpu")
+  parser.add_argument("--host", default="0.0.0.0")
+  parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument("--max-batch-size", type=int, default=default_max_batch_size)
+  parser.add_argument("--max-wait-ms", type=float, default=default_max_wait_ms)
+  parser.add_argument("--max-new-tokens", type=int, default=default_max_new_tokens)
+  parser.add_argument("--cache-size", type=int, default=default_cache_size)
+  parser.add_argument("--outcome-log", default=None, help="Append every uncached request's outcome to this JSONL file for hard-example mining.")
+  args = parser.parse_args()
+
+  tokenizer = AutoTokenizer.from_pretrained(args.model)
+  if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
+
+  model = AutoModelForCausalLM.from_pretrained(
+    args.model,
+    torch_dtype=torch.bfloat16 if args.device != "cpu" else torch.float32
+  ).to(args.device)
+  model.eval()
+
+  # Outcomes are filtered by model when mining, so tie them to the served weights.
+  model_key = None
+  if args.outcome_log:
+    model_key = get_model_key(args.model, args.model if os.path.isdir(args.model) else None)
+
+  web.run_app(
+    create_app(
+      model,
+      tokenizer,
+      max_batch_size=args.max_batch_size,
+      max_wait_ms=args.max_wait_ms,
+      max_new_tokens=args.max_new_tokens,
+      cache_size=args.cache_size,
+      outcome_log_path=args.outcome_log,
+      model_key=model_key
+    ),
+    host=args.host,
+    port=args.port
+  )
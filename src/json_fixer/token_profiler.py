@@ -0,0 +1,217 @@
+import argparse
+import hashlib
+import json
+import os
+
+import jsonlines
+import numpy as np
+
+from json_fixer.convert_to_conversation import convert_to_conversation
+from json_fixer.training_config import training_configuration, model_id
+from utils.example_tags import detect_error_types, get_payload_size
+
+default_num_proc = max(1, (os.cpu_count() or 1) // 2)
+default_batch_size = 256
+histogram_bucket_tokens = 128
+report_percentiles = [50, 90, 95, 99, 100]
+# Bumped whenever the way tokens are counted changes, so stale caches are recomputed.
+token_count_version = 2
+
+
+def get_cache_path(dataset_path: str) -> str:
+  return f"{os.path.splitext(dataset_path)[0]}.token_lengths.json"
+
+
+def hash_file(path: str) -> str:
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+
+  return digest.hexdigest()
+
+
+def load_token_lengths(dataset_path: str, tokenizer_id: str = model_id) -> list[dict] | None:
+  """
+  Return the cached per-example token counts for a JSONL split, or None if there is no
+  cache or it was computed for a different file or tokenizer.
+  """
+  cache_path = get_cache_path(dataset_path)
+  if not os.path.exists(cache_path):
+    return None
+
+  with open(cache_path, "r") as f:
+    cache = json.load(f)
+
+  if cache.get("version") != token_count_version or cache["tokenizer_id"] != tokenizer_id or cache["dataset_sha256"] != hash_file(dataset_path):
+    return None
+
+  return cache["lengths"]
+
+
+def append_eos(tokenizer, text: str) -> str:
+  # SFTTrainer appends EOS to the text field unless it's already there, and it counts
+  # towards max_length like every other token.
+  if tokenizer.eos_token and not text.endswith(tokenizer.eos_token):
+    return text + tokenizer.eos_token
+
+  return text
+
+
+def count_tokens(batch: dict, tokenizer) -> dict:
+  prompt_texts = []
+  full_texts = []
+  for invalid_json, fixed_json in zip(batch["invalid_json"], batch["fixed_json"]):
+    conversation = convert_to_conversation({"invalid_json": invalid_json, "fixed_json": fixed_json})["conversations"]
+    # Same formatting as formatting_prompts_func in train.py.
+    full_texts.append(append_eos(tokenizer, tokenizer.apply_chat_template(conversation, tokenize=False, add_generation_prompt=False)))
+    prompt_texts.append(tokenizer.apply_chat_template(conversation[:1], tokenize=False, add_generation_prompt=True))
+
+  prompt_ids = tokenizer(prompt_texts, add_special_tokens=False)["input_ids"]
+  full_ids = tokenizer(full_texts, add_special_tokens=False)["input_ids"]
+
+  return {
+    "prompt_tokens": [len(p) for p in prompt_ids],
+    "completion_tokens": [len(f) - len(p) for p, f in zip(prompt_ids, full_ids)],
+    "total_tokens": [len(f) for f in full_ids]
+  }
+
+
+def get_token_lengths(dataset_path: str, tokenizer, tokenizer_id: str = model_id, num_proc: int = default_num_proc, batch_size: int = default_batch_size) -> list[dict]:
+  """
+  Per-example prompt, completion and total token counts for a JSONL split, tokenized in
+  batches across `num_proc` processes. Results are cached next to the split.
+  """
+  lengths = load_token_lengths(dataset_path, tokenizer_id)
+  if lengths is not None:
+    return lengths
+
+  from datasets import Dataset
+
+  with jsonlines.open(dataset_path) as j:
+    records = [{"invalid_json": r["invalid_json"], "fixed_json": r["fixed_json"]} for r in j]
+
+  counted = Dataset.from_list(records).map(
+    count_tokens,
+    batched=True,
+    batch_size=batch_size,
+    num_proc=min(num_proc, max(1, len(records) // batch_size)),
+    fn_kwargs={"tokenizer": tokenizer},
+    remove_columns=["invalid_json", "fixed_json"]
+  )
+
+  lengths = [
+    {
+      "prompt_tokens": row["prompt_tokens"],
+      "completion_tokens": row["completion_tokens"],
+      "total_tokens": row["total_tokens"]
+    } for row in counted
+  ]
+
+  with open(get_cache_path(dataset_path), "w") as f:
+    json.dump(
+      {
+        "version": token_count_version,
+        "tokenizer_id": tokenizer_id,
+        "dataset_sha256": hash_file(dataset_path),
+        "lengths": lengths
+      },
+      f
+    )
+
+  return lengths
+
+
+def get_truncated_indices(lengths: list[dict], max_length: int) -> list[int]:
+  return [i for i, length in enumerate(lengths) if length["total_tokens"] > max_length]
+
+
+def summarize(total_tokens: list[int]) -> dict:
+  values = np.array(total_tokens)
+  bucket_edges = np.arange(0, values.max() + histogram_bucket_tokens, histogram_bucket_tokens)
+  counts, edges = np.histogram(values, bins=bucket_edges if len(bucket_edges) > 1 else 1)
+
+  return {
+    "count": int(len(values)),
+    "percentiles": {f"p{p}": int(np.percentile(values, p)) for p in report_percentiles},
+    "histogram": [
+      {"start": int(edges[i]), "end": int(edges[i + 1]), "count": int(counts[i])}
+      for i in range(len(counts)) if counts[i] > 0
+    ]
+  }
+
+
+def create_report(dataset: list[dict], lengths: list[dict], max_length: int) -> dict:
+  by_error_type = {}
+  by_payload_size = {}
+  for example, length in zip(dataset, lengths):
+    for error_type in detect_error_types(example["invalid_json"], example["fixed_json"]):
+      by_error_type.setdefault(error_type, []).append(length["total_tokens"])
+    by_payload_size.setdefault(get_payload_size(example["fixed_json"]), []).append(length["total_tokens"])
+
+  truncated = get_truncated_indices(lengths, max_length)
+
+  return {
+    "max_length": max_length,
+    "overall": summarize([length["total_tokens"] for length in lengths]),
+    "prompt_tokens": summarize([length["prompt_tokens"] for length in lengths]),
+    "completion_tokens": summarize([length["completion_tokens"] for length in lengths]),
+    "by_error_type": {k: summarize(v) for k, v in sorted(by_error_type.items())},
+    "by_payload_size": {k: summarize(v) for k, v in sorted(by_payload_size.items())},
+    "truncated": [
+      {
+        "index": i,
+        "total_tokens": lengths[i]["total_tokens"],
+        # The prompt alone not fitting means the model never even sees the whole input.
+        "prompt_truncated": lengths[i]["prompt_tokens"] > max_length
+      } for i in truncated
+    ]
+  }
+
+
+def print_summary(name: str, summary: dict):
+  percentiles = ", ".join(f"{k}={v}" for k, v in summary["percentiles"].items())
+  print(f"{name:<20} n={summary['count']:<6} {percentiles}")
+
+
+if __name__ == "__main__":
+  from transformers import AutoTokenizer
+
+  parser = argparse.ArgumentParser(description="Profile chat-templated token lengths of a JSONL split and flag examples that would be truncated.")
+  parser.add_argument("dataset", help="JSONL file with invalid_json/fixed_json records.")
+  parser.add_argument("--tokenizer", default=model_id)
+  parser.add_argument("--max-length", type=int, default=training_configuration["train"]["max_length"])
+  parser.add_argument("--num-proc", type=int, default=default_num_proc)
+  parser.add_argument("--report", default=None, help="Where to write the JSON report. Defaults to <dataset>.token_report.json.")
+  parser.add_argument("--drop-truncated", default=None, help="Write the examples that fit in --max-length to this JSONL file.")
+  args = parser.parse_args()
+
+  tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+
+  with jsonlines.open(args.dataset) as j:
+    dataset = list(j)
+
+  lengths = get_token_lengths(args.dataset, tokenizer, args.tokenizer, num_proc=args.num_proc)
+  report = create_report(dataset, lengths, args.max_length)
+
+  report_path = args.report or f"{os.path.splitext(args.dataset)[0]}.token_report.json"
+  with open(report_path, "w") as f:
+    json.dump(report, f, indent=2)
+
+  print_summary("overall", report["overall"])
+  for error_type, summary in report["by_error_type"].items():
+    print_summary(error_type, summary)
+  for payload_size, summary in report["by_payload_size"].items():
+    print_summary(payload_size, summary)
+
+  print(f"{len(report['truncated'])} of {len(dataset)} examples exceed max_length={args.max_length}.")
+  for t in report["truncated"]:
+    print(f"  example {t['index']}: {t['total_tokens']} tokens{' (prompt truncated)' if t['prompt_truncated'] else ''}")
+
+  if args.drop_truncated:
+    truncated = {t["index"] for t in report["truncated"]}
+    with jsonlines.open(args.drop_truncated, "w") as j:
+      j.write_all([example for i, example in enumerate(dataset) if i not in truncated])
+    print(f"Wrote {len(dataset) - len(truncated)} examples to {args.drop_truncated}")
+
+  print(f"Wrote report to {report_path}")
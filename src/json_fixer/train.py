@@ -1,55 +1,32 @@
 from datasets import Dataset
 from json_fixer.convert_to_conversation import convert_to_conversation
+from json_fixer.curriculum import CurriculumSampler, CurriculumSFTTrainer, TokensToTargetCallback
+from json_fixer.generative_eval_callback import GenerativeAccuracyCallback
 import jsonlines
-from peft import get_peft_model, LoraConfig
+from json_fixer.memory_planner import apply_memory_plan
+from json_fixer.token_profiler import get_token_lengths, get_truncated_indices
+from json_fixer.training_config import (
+  training_configuration,
+  model_id,
+  fine_tuned_model_id,
+  train_dataset_path,
+  eval_dataset_path,
+  create_lora_config
+)
+from peft import get_peft_model
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
-from trl import SFTTrainer, SFTConfig
-
-training_configuration = {
-  "lora": {
-    "rank": 32,
-    "alpha": 32,
-    "dropout": 0.0,
-    "target_modules": [
-      "q_proj",
-      "k_proj",
-      "v_proj",
-      "o_proj",
-      "gate_proj",
-      "up_proj",
-      "down_proj"
-    ]
-  },
-  "train": {
-    "eval_accumulation_steps": 1, 
-    "eval_steps": 100,
-    "gradient_accumulation_steps": 4,
-    "learning_rate": 2.5e-5,
-    "learning_rate_scheduler_type": "cosine",
-    "logging_steps": 4,
-    "max_length": 2048,
-    "num_train_epochs": 6,
-    "output_dir": "checkpoints",
-    "per_device_eval_batch_size": 1,
-    "per_device_train_batch_size": 1,
-    "save_steps": 100,
-    "warmup_ratio": 0.05
-  }
-}
-
-model_id = "unsloth/Qwen3-0.6B"
-fine_tuned_model_id = "Qwen3-0.6B-finetuned"
-train_dataset_path = "/home/rngo/code/intel-gpu-fine-tune/dataset/train_data.jsonl"
-eval_dataset_path = "/home/rngo/code/intel-gpu-fine-tune/dataset/eval_data.jsonl"
+from trl import SFTConfig
+
+# Pick up batch size / accumulation / checkpointing chosen by memory_planner.py, if present.
+apply_memory_plan(training_configuration)
 
 with jsonlines.open(train_dataset_path) as j:
   train_dataset = list(j)
-converted_train_dataset = [convert_to_conversation(example) for example in train_dataset]
 
 with jsonlines.open(eval_dataset_path) as j:
-  eval_dataset = list(j)
-converted_eval_dataset = [convert_to_conversation(example) for example in eval_dataset]
+  eval_dataset_raw = list(j)
+converted_eval_dataset = [convert_to_conversation(example) for example in eval_dataset_raw]
 
 model = AutoModelForCausalLM.from_pretrained(
   model_id,
@@ -63,13 +40,18 @@ tokenizer = AutoTokenizer.from_pretrained(
 )
 tokenizer.pad_token = tokenizer.eos_token
 
-lora_config = LoraConfig(
-  r=training_configuration["lora"]["rank"],
-  lora_alpha=training_configuration["lora"]["alpha"],
-  lora_dropout=training_configuration["lora"]["dropout"],
-  bias="none",
-  target_modules=training_configuration["lora"]["target_modules"]
-)
+# Examples longer than max_length get silently truncated by the trainer, which teaches the
+# model to emit cut-off JSON. Drop them up-front using the cached token lengths.
+train_token_lengths = get_token_lengths(train_dataset_path, tokenizer)
+if training_configuration["train"]["drop_truncated_examples"]:
+  truncated = set(get_truncated_indices(train_token_lengths, training_configuration["train"]["max_length"]))
+  if truncated:
+    print(f"Dropping {len(truncated)} training examples longer than max_length.")
+  train_dataset = [example for i, example in enumerate(train_dataset) if i not in truncated]
+train_dataset_raw = train_dataset
+converted_train_dataset = [convert_to_conversation(example) for example in train_dataset_raw]
+
+lora_config = create_lora_config()
 
 model = get_peft_model(model, lora_config)
 
@@ -96,11 +78,38 @@ eval_dataset = Dataset.from_list(converted_eval_dataset).map(
   batched=True
 )
 
-trainer = SFTTrainer(
+# Eval loss alone doesn't tell us whether the model emits the exact fixed JSON, so
+# periodically score generations and stop once accuracy plateaus.
+generative_accuracy_callback = GenerativeAccuracyCallback(
+  tokenizer=tokenizer,
+  eval_examples=eval_dataset_raw,
+  eval_steps=training_configuration["generative_eval"]["eval_steps"],
+  num_examples=training_configuration["generative_eval"]["num_examples"],
+  batch_size=training_configuration["generative_eval"]["batch_size"],
+  max_new_tokens=training_configuration["generative_eval"]["max_new_tokens"],
+  patience=training_configuration["generative_eval"]["patience"],
+  min_delta=training_configuration["generative_eval"]["min_delta"]
+)
+
+# The default "uniform" mode is a plain shuffle and records the baseline tokens-to-target
+# accuracy. "tags" and "loss" spend fewer tokens on examples the model has already learned.
+curriculum_sampler = CurriculumSampler(
+  train_dataset_raw,
+  num_epochs=training_configuration["train"]["num_train_epochs"],
+  mode=training_configuration["curriculum"]["mode"],
+  warmup_epochs=training_configuration["curriculum"]["warmup_epochs"],
+  easy_loss_threshold=training_configuration["curriculum"]["easy_loss_threshold"],
+  easy_weight=training_configuration["curriculum"]["easy_weight"],
+  loss_ema_decay=training_configuration["curriculum"]["loss_ema_decay"]
+)
+
+trainer = CurriculumSFTTrainer(
+  curriculum_sampler=curriculum_sampler,
   model=model,
   processing_class=tokenizer,
   train_dataset=train_dataset,
   eval_dataset=eval_dataset,
+  callbacks=[generative_accuracy_callback],
   args=SFTConfig(
     dataset_text_field="text",
     eval_accumulation_steps=training_configuration["train"]["eval_accumulation_steps"],
@@ -109,7 +118,7 @@ trainer = SFTTrainer(
     gradient_accumulation_steps=training_configuration["train"]["gradient_accumulation_steps"],
 
     # Use this to save some VRAM - instead of saving all the activations, we will recompute dynamically.
-    gradient_checkpointing=True,
+    gradient_checkpointing=training_configuration["train"]["gradient_checkpointing"],
 
     # Do not use reentrant way of gradient checkpointing.
     gradient_checkpointing_kwargs={"use_reentrant": False},
@@ -133,6 +142,15 @@ trainer = SFTTrainer(
   )
 )
 
+trainer.add_callback(
+  TokensToTargetCallback(
+    trainer,
+    generative_accuracy_callback,
+    target_accuracy=training_configuration["curriculum"]["target_accuracy"],
+    output_dir=training_configuration["train"]["output_dir"]
+  )
+)
+
 trainer.train()
 
 # Save LoRA adapters
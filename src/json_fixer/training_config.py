@@ -0,0 +1,69 @@
+training_configuration = {
+  "lora": {
+    "rank": 32,
+    "alpha": 32,
+    "dropout": 0.0,
+    "target_modules": [
+      "q_proj",
+      "k_proj",
+      "v_proj",
+      "o_proj",
+      "gate_proj",
+      "up_proj",
+      "down_proj"
+    ]
+  },
+  "curriculum": {
+    "easy_loss_threshold": 0.05,
+    "easy_weight": 0.1,
+    "loss_ema_decay": 0.5,
+    # one of "uniform", "tags" or "loss". "uniform" is the recipe behind the README results;
+    # the others are opt-in until a tokens-to-target comparison against it exists.
+    "mode": "uniform",
+    "target_accuracy": 0.85,
+    "warmup_epochs": 1
+  },
+  "generative_eval": {
+    "batch_size": 8,
+    "eval_steps": 100,
+    "max_new_tokens": 2048,
+    "min_delta": 0.0,
+    "num_examples": 46,
+    "patience": 3
+  },
+  "train": {
+    "eval_accumulation_steps": 1, 
+    "drop_truncated_examples": True,
+    "eval_steps": 100,
+    "gradient_accumulation_steps": 4,
+    "gradient_checkpointing": True,
+    "learning_rate": 2.5e-5,
+    "learning_rate_scheduler_type": "cosine",
+    "logging_steps": 4,
+    "max_length": 2048,
+    "memory_plan_path": "memory_plan.json",
+    "num_train_epochs": 6,
+    "output_dir": "checkpoints",
+    "per_device_eval_batch_size": 1,
+    "per_device_train_batch_size": 1,
+    "save_steps": 100,
+    "warmup_ratio": 0.05
+  }
+}
+
+model_id = "unsloth/Qwen3-0.6B"
+fine_tuned_model_id = "Qwen3-0.6B-finetuned"
+train_dataset_path = "/home/rngo/code/intel-gpu-fine-tune/dataset/train_data.jsonl"
+eval_dataset_path = "/home/rngo/code/intel-gpu-fine-tune/dataset/eval_data.jsonl"
+
+
+def create_lora_config():
+  from peft import LoraConfig
+
+  return LoraConfig(
+    r=training_configuration["lora"]["rank"],
+    lora_alpha=training_configuration["lora"]["alpha"],
+    lora_dropout=training_configuration["lora"]["dropout"],
+    bias="none",
+    target_modules=training_configuration["lora"]["target_modules"]
+  )
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+default_max_bytes = 512 * 1024 * 1024
+
+
+# Written next to the weights so the full hash only runs again when the files change.
+checkpoint_digest_file = ".checkpoint_sha256.json"
+
+
+def get_checkpoint_files(checkpoint_path: str) -> list[str]:
+  return [
+    name for name in sorted(os.listdir(checkpoint_path))
+    if name.endswith(".safetensors") or name.endswith(".bin") or name == "config.json"
+  ]
+
+
+def hash_checkpoint(checkpoint_path: str) -> str:
+  """
+  Content hash of a local checkpoint directory's config and weight files. The digest is
+  memoized next to the checkpoint, keyed on each file's name, size and modification time.
+  """
+  files = get_checkpoint_files(checkpoint_path)
+  signature = []
+  for name in files:
+    stat = os.stat(os.path.join(checkpoint_path, name))
+    signature.append([name, stat.st_size, stat.st_mtime_ns])
+
+  digest_path = os.path.join(checkpoint_path, checkpoint_digest_file)
+  if os.path.exists(digest_path):
+    with open(digest_path, "r") as f:
+      memoized = json.load(f)
+    if memoized["files"] == signature:
+      return memoized["sha256"]
+
+  digest = hashlib.sha256()
+  for name in files:
+    digest.update(name.encode("utf-8"))
+    with open(os.path.join(checkpoint_path, name), "rb") as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        digest.update(chunk)
+
+  try:
+    with open(digest_path, "w") as f:
+      json.dump({"files": signature, "sha256": digest.hexdigest()}, f)
+  except OSError:
+    # A read-only checkpoint just gets hashed every time.
+    pass
+
+  return digest.hexdigest()
+
+
+def get_model_key(model: str, checkpoint_path: str | None = None) -> str:
+  """
+  Identify the model a completion came from. The served model name alone is ambiguous when
+  a retrained checkpoint is deployed under the same name, so include the weights' hash when
+  the checkpoint is available locally.
+  """
+  if checkpoint_path is None:
+    print(
+      f"Warning: no checkpoint path for {model}, caching completions by model name only. "
+      f"A retrained model served under the same name will get the old completions back."
+    )
+    return model
+
+  return f"{model}@{hash_checkpoint(checkpoint_path)}"
+
+
+class CompletionCache:
+  """
+  On-disk cache of raw model completions keyed by (model key, prompt messages, sampling
+  params), so evaluation can be rescored without re-querying the model. Least recently used
+  entries are evicted once the stored completions exceed `max_bytes`.
+  """
+  def __init__(self, path: str, max_bytes: int = default_max_bytes):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+    self.connection = sqlite3.connect(path)
+    self.connection.execute(
+      """CREATE TABLE IF NOT EXISTS completions (
+        key TEXT PRIMARY KEY,
+        model_key TEXT NOT NULL,
+        completion TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        last_access REAL NOT NULL
+      )"""
+    )
+    self.connection.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+    self.connection.commit()
+
+  @staticmethod
+  def make_key(model_key: str, messages: list[dict], params: dict) -> str:
+    payload = json.dumps(
+      {"model": model_key, "messages": messages, "params": params},
+      sort_keys=True,
+      ensure_ascii=False
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+  def get(self, model_key: str, messages: list[dict], params: dict) -> str | None:
+    key = self.make_key(model_key, messages, params)
+    row = self.connection.execute("SELECT completion FROM completions WHERE key = ?", (key,)).fetchone()
+
+    if row is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self.connection.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+    self.connection.commit()
+
+    return row[0]
+
+  def put(self, model_key: str, messages: list[dict], params: dict, completion: str | None):
+    # The API allows an empty (None) message content. Don't cache it, so it's retried next run.
+    if completion is None:
+      return
+
+    key = self.make_key(model_key, messages, params)
+    self.connection.execute(
+      "INSERT OR REPLACE INTO completions (key, model_key, completion, size, last_access) VALUES (?, ?, ?, ?, ?)",
+      (key, model_key, completion, len(completion.encode("utf-8")), time.time())
+    )
+    self.evict()
+    self.connection.commit()
+
+  def size_bytes(self) -> int:
+    return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+  def evict(self):
+    excess = self.size_bytes() - self.max_bytes
+    if excess <= 0:
+      return
+
+    freed = 0
+    evicted = []
+    for key, size in self.connection.execute("SELECT key, size FROM completions ORDER BY last_access ASC"):
+      if freed >= excess:
+        break
+      evicted.append((key,))
+      freed += size
+
+    self.connection.executemany("DELETE FROM completions WHERE key = ?", evicted)
+    self.evictions += len(evicted)
+
+  def stats(self) -> dict:
+    lookups = self.hits + self.misses
+
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+      "evictions": self.evictions,
+      "entries": self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0],
+      "size_bytes": self.size_bytes()
+    }
+
+  def close(self):
+    self.connection.close()
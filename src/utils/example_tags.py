@@ -0,0 +1,117 @@
+import argparse
+from collections import Counter
+
+import jsonlines
+
+from utils.json_tokens import has_invalid_escape, scan_tokens
+
+# Line-count thresholds of the pretty-printed fixed JSON. The generator prompt asks for
+# "large payloads" of at least ~120 lines.
+medium_payload_lines = 40
+large_payload_lines = 120
+
+error_type_names = [
+  "newline",
+  "quotes",
+  "backslash",
+  "unquoted_key",
+  "unquoted_value",
+  "comma",
+  "extra_brace",
+  "comment",
+  "nonfinite_number"
+]
+
+literals = ("true", "false", "null")
+nonfinite_tokens = ("NaN", "Infinity", "-Infinity")
+
+
+def get_brace_balance(text: str) -> dict:
+  balance = {"{": 0, "[": 0}
+  for kind, token, _, _, _ in scan_tokens(text):
+    if kind != "punctuation":
+      continue
+    if token in balance:
+      balance[token] += 1
+    elif token in ("}", "]"):
+      balance["{" if token == "}" else "["] -= 1
+
+  return balance
+
+
+def detect_error_types(invalid_json: str, fixed_json: str) -> list[str]:
+  """
+  Best-effort guess of the generator's error types for an example. The generated datasets
+  don't keep `error_types`, so this is what per-category reporting is keyed on. Valid JSON
+  gets no tags.
+  """
+  found = set()
+  previous = None
+
+  for kind, token, _, _, key_position in scan_tokens(invalid_json):
+    if kind in ("string", "quoted_key"):
+      if "\n" in token:
+        found.add("newline")
+      if has_invalid_escape(token):
+        found.add("backslash")
+    elif kind in ("line_comment", "block_comment"):
+      found.add("comment")
+      continue
+    elif kind == "bareword":
+      if key_position:
+        found.add("unquoted_key")
+      elif token in nonfinite_tokens:
+        found.add("nonfinite_number")
+      # A bareword right after a string is the tail of a string broken by an inner quote.
+      elif token not in literals and previous in (":", ",", "["):
+        found.add("unquoted_value")
+    elif kind == "space":
+      continue
+
+    if (token == "," and previous in (",", "[", "{")) or (token in ("]", "}") and previous == ","):
+      found.add("comma")
+
+    previous = token
+
+  if fixed_json.count("\\\"") > invalid_json.count("\\\""):
+    found.add("quotes")
+  if get_brace_balance(invalid_json) != get_brace_balance(fixed_json):
+    found.add("extra_brace")
+
+  return [error_type for error_type in error_type_names if error_type in found] or ["unknown"]
+
+
+def get_payload_size(fixed_json: str) -> str:
+  """Bucket an example by the line count of its fixed JSON: small, medium or large."""
+  num_lines = fixed_json.count("\n") + 1
+
+  if num_lines >= large_payload_lines:
+    return "large"
+  if num_lines >= medium_payload_lines:
+    return "medium"
+
+  return "small"
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Check the error-type tagger: valid fixed_json must get no tags. Prints the tag histogram of the inputs.")
+  parser.add_argument("dataset", help="JSONL file with invalid_json/fixed_json records.")
+  args = parser.parse_args()
+
+  with jsonlines.open(args.dataset) as j:
+    dataset = list(j)
+
+  false_positives = Counter()
+  tags = Counter()
+  for example in dataset:
+    false_positives.update(e for e in detect_error_types(example["fixed_json"], example["fixed_json"]) if e != "unknown")
+    tags.update(detect_error_types(example["invalid_json"], example["fixed_json"]))
+
+  for error_type, count in tags.most_common():
+    print(f"  {error_type:<18} {count}")
+
+  if false_positives:
+    print(f"Valid fixed_json was tagged: {dict(false_positives)}")
+    raise SystemExit(1)
+
+  print(f"No tags on the {len(dataset)} valid fixed_json documents.")
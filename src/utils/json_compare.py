@@ -0,0 +1,17 @@
+import json
+from utils.clean_message import clean_message
+
+def matches_ground_truth(assistant_message: str, fixed_json: str) -> bool:
+  """
+  Exact-match scoring used for evaluation: the cleaned model output and the ground truth
+  must be identical once both are parsed and re-serialized with 2-space indentation. Output
+  that can't be cleaned or parsed, e.g. thinking cut off at max_new_tokens, is a mismatch.
+  """
+  try:
+    assistant_message_prettified = json.dumps(json.loads(clean_message(assistant_message)), indent=2)
+  except (ValueError, IndexError):
+    return False
+
+  ground_truth = json.dumps(json.loads(fixed_json), indent=2)
+
+  return assistant_message_prettified == ground_truth
@@ -0,0 +1,71 @@
+import re
+from typing import Iterator
+
+# One alternative per token kind, tried in order at the current position. Matching whole
+# tokens (strings, whitespace runs) at once keeps the scan fast on large payloads.
+token_pattern = re.compile(
+  r"""(?P<space>(?:[ \t\r\n]|\\[nrt])+)"""
+  # "//" right after a colon or word character is a URL, not a comment. Single-line blobs
+  # often carry an escaped "\n" rather than a real line break to end the comment.
+  r"""|(?P<line_comment>(?<![:\w])//(?:(?!\\n)[^\n])*)"""
+  r"""|(?P<block_comment>/\*[\s\S]*?(?:\*/|\Z))"""
+  r"""|(?P<string>"(?:[^"\\]|\\[\s\S])*"?)"""
+  r"""|(?P<quoted_key>'(?:[^'\\]|\\[\s\S])*'?)"""
+  r"""|(?P<punctuation>[{}\[\]:,])"""
+  r"""|(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)"""
+  r"""|(?P<bareword>-?[A-Za-z_$][\w$\-]*)"""
+  r"""|(?P<other>[\s\S])"""
+)
+
+# A backslash always starts a two-character (or \uXXXX) escape, so pairs are consumed
+# together and "\\\\U" is an escaped backslash followed by a plain "U".
+escape_pattern = re.compile(r"\\(?:(?P<valid>[\"\\/bfnrt]|u[0-9a-fA-F]{4})|[\s\S]?)")
+
+
+def scan_tokens(text: str, implicit_root: str | None = None) -> Iterator[tuple[str, str, int, int, bool]]:
+  """
+  Tokenize possibly-invalid JSON text, tolerating the errors the generator introduces
+  (literal newlines in strings, comments, barewords, stray commas, single-quoted keys).
+
+  Yields (kind, token, start, depth, key_position) for every token, where `depth` is the
+  container depth the token sits at and `key_position` is whether an object key is expected
+  there. Strings are never split, so anything but a "string" or "quoted_key" token is
+  outside of strings. `implicit_root` ("{" or "[") treats the text as if it started with
+  that opener, for inputs that lost their opening brace.
+  """
+  stack = [implicit_root] if implicit_root else []
+  expecting_key = implicit_root == "{"
+  position = 0
+  while position < len(text):
+    match = token_pattern.match(text, position)
+    kind = match.lastgroup
+    token = match.group(0)
+
+    # Single-quoted keys are common in the invalid inputs; elsewhere an apostrophe is more
+    # likely to be part of a bareword or broken string than a delimiter.
+    if kind == "quoted_key" and not expecting_key:
+      kind = "other"
+      token = "'"
+
+    start = position
+    position = start + len(token)
+    yield kind, token, start, len(stack), expecting_key
+
+    if kind in ("space", "line_comment", "block_comment"):
+      continue
+
+    if token in ("{", "["):
+      stack.append(token)
+      expecting_key = token == "{"
+    elif token in ("}", "]"):
+      if stack:
+        stack.pop()
+      expecting_key = False
+    elif token == ",":
+      expecting_key = bool(stack) and stack[-1] == "{"
+    else:
+      expecting_key = False
+
+
+def has_invalid_escape(string_token: str) -> bool:
+  return any(match.group("valid") is None for match in escape_pattern.finditer(string_token))
@@ -1,5 +1,12 @@
 import json
 
+def reject_nonfinite_constant(constant: str):
+  raise json.JSONDecodeError(f"{constant} is not valid JSON", constant, 0)
+
+def loads_strict(json_str: str):
+  # json.loads happily accepts NaN, Infinity and -Infinity, which are not valid JSON.
+  return json.loads(json_str, parse_constant=reject_nonfinite_constant)
+
 def validate_json_string(json_str: str) -> bool:
   try:
     json.loads(json_str)
@@ -0,0 +1,20 @@
+import jsonlines
+
+from utils.example_tags import detect_error_types, get_payload_size
+
+def record_outcome(path: str, source: str, invalid_json: str, passed: bool, fixed_json: str | None = None, model: str | None = None):
+  """
+  Append one evaluation or production outcome, tagged with its error types and payload size,
+  so failure rates can be aggregated per category later. Without a ground truth (production
+  traffic), tags and size are guessed from the input alone.
+  """
+  with jsonlines.open(path, "a") as j:
+    j.write({
+      "source": source,
+      "model": model,
+      "passed": passed,
+      "error_types": detect_error_types(invalid_json, fixed_json or ""),
+      "payload_size": get_payload_size(fixed_json or invalid_json),
+      "invalid_json": invalid_json,
+      "fixed_json": fixed_json
+    })
@@ -1,7 +1,8 @@
 import re
 
 def strip_think_tags(message: str) -> str:
-  if message.find("</think>") and not message.find("<think>"):
+  # The chat template can put the opening tag in the prompt, leaving only the closing one.
+  if "</think>" in message and "<think>" not in message:
     return message.split("</think>")[1]
 
   message = re.sub(r'<think>.*?</think>', "", message, flags=re.DOTALL).strip()